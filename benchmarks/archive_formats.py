@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Transfer size and publish time of repository archives per format.
+
+Run against a GitLab instance with a token that can read the sample
+projects:
+
+.. code-block:: console
+
+   $ export GITLAB_URL=https://gitlab.com GITLAB_TOKEN=...
+   $ python benchmarks/archive_formats.py group/project@v1.0.0 other/repo
+
+For every project (optionally at a given tag, branch or commit) and every
+format of ``GITLAB_ARCHIVE_FORMATS``, the archive is streamed through
+:class:`~invenio_gitlab.archive.ArchiveStream` into a local files storage,
+like ``GitLabRelease.publish`` does. The transferred bytes, the wall time
+and the CPU time of the worker process are printed for each run.
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import gitlab
+from invenio_files_rest.storage import PyFSFileStorage
+
+from invenio_gitlab.archive import ArchiveStream
+from invenio_gitlab.config import GITLAB_ARCHIVE_CHUNK_SIZE, GITLAB_ARCHIVE_FORMATS
+
+
+def run(project, ref, archive_format, path):
+    """Store one archive and return its size, wall time and CPU time."""
+    start, cpu_start = time.time(), time.process_time()
+    archive = ArchiveStream.from_project(
+        project, ref, chunk_size=GITLAB_ARCHIVE_CHUNK_SIZE,
+        format=archive_format)
+    try:
+        PyFSFileStorage(path).save(archive)
+    finally:
+        archive.close()
+    return (archive.size, time.time() - start,
+            time.process_time() - cpu_start)
+
+
+def main(projects):
+    """Run the benchmark for all sample projects."""
+    gl = gitlab.Gitlab(os.environ.get('GITLAB_URL', 'https://gitlab.com'),
+                       private_token=os.environ.get('GITLAB_TOKEN'))
+    tmpdir = tempfile.mkdtemp()
+    print('{0:<40} {1:>8} {2:>12} {3:>10} {4:>10}'.format(
+        'project', 'format', 'size (MiB)', 'time (s)', 'cpu (s)'))
+    try:
+        for name in projects:
+            name, _, ref = name.partition('@')
+            project = gl.projects.get(name)
+            ref = ref or project.default_branch
+            for archive_format in GITLAB_ARCHIVE_FORMATS:
+                path = os.path.join(tmpdir, 'archive')
+                size, elapsed, cpu = run(project, ref, archive_format, path)
+                os.remove(path)
+                print('{0:<40} {1:>8} {2:>12.1f} {3:>10.1f} {4:>10.2f}'.format(
+                    name, archive_format, size / 1024.0 / 1024.0, elapsed,
+                    cpu))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Peak memory of a full project sync against a local fake GitLab.
+
+Run with the test dependencies installed:
+
+.. code-block:: console
+
+   $ python benchmarks/sync_memory.py 10000 50000 100000
+
+For every project count, a fake GitLab instance serving that many owned
+projects is started on localhost and ``GitLabAPI.sync(full=True)`` is run
+under :mod:`tracemalloc`. The peak of Python allocations and the wall time
+are printed for each run. The first run also includes one-off allocations,
+e.g. of the SQLAlchemy statement caches.
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+from flask import Flask
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.urllib_parse import parse_qs, urlparse
+
+
+def fake_gitlab(total):
+    """Start a fake GitLab serving ``total`` owned projects."""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Paginated ``/projects`` endpoint."""
+
+        def log_message(self, *args):
+            """Silence request logging."""
+
+        def send_json(self, data, headers=()):
+            """Send a JSON response."""
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            """Return the current user or one page of projects."""
+            url = urlparse(self.path)
+            if url.path.endswith('/user'):
+                self.send_json(dict(id=1, username='bench'))
+                return
+            query = parse_qs(url.query)
+            page = int(query.get('page', ['1'])[0])
+            per_page = int(query.get('per_page', ['20'])[0])
+            first = (page - 1) * per_page
+            ids = range(first, min(first + per_page, total))
+            headers = []
+            if first + per_page < total:
+                query['page'] = [str(page + 1)]
+                next_url = 'http://{0}:{1}{2}?{3}'.format(
+                    self.server.server_address[0], self.server.server_port,
+                    url.path, '&'.join(
+                        '{0}={1}'.format(k, v[0]) for k, v in query.items()))
+                headers.append(('Link', '<{0}>; rel="next"'.format(next_url)))
+            self.send_json([dict(
+                id=i,
+                description='Project {0}'.format(i),
+                name='project{0}'.format(i),
+                path_with_namespace='bench/project{0}'.format(i),
+            ) for i in ids], headers)
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def create_app():
+    """Create a minimal application with an in-memory database."""
+    from invenio_accounts import InvenioAccounts
+    from invenio_db import InvenioDB
+    from invenio_i18n import InvenioI18N
+    from invenio_oauthclient import InvenioOAuthClient
+
+    from invenio_gitlab import InvenioGitLab
+
+    app = Flask('benchmark')
+    app.config.update(
+        SECRET_KEY='SECRET_KEY',
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SECURITY_PASSWORD_HASH='plaintext',
+        SECURITY_PASSWORD_SCHEMES=['plaintext'],
+        SECURITY_DEPRECATED_PASSWORD_SCHEMES=[],
+    )
+    InvenioDB(app)
+    InvenioI18N(app)
+    InvenioAccounts(app)
+    InvenioOAuthClient(app)
+    InvenioGitLab(app)
+    return app
+
+
+def run(app, total):
+    """Sync ``total`` projects and return peak memory and wall time."""
+    from invenio_db import db
+    from invenio_oauthclient.models import RemoteAccount
+
+    from invenio_gitlab.api import GitLabAPI
+    from invenio_gitlab.utils import iso_utcnow
+
+    server = fake_gitlab(total)
+    app.config['GITLAB_BASE_URL'] = 'http://127.0.0.1:{0}'.format(
+        server.server_port)
+    with app.app_context():
+        db.create_all()
+        user = app.extensions['security'].datastore.create_user(
+            email='bench@hzdr.de', password='bench', active=True)
+        db.session.commit()
+        gl = GitLabAPI(user_id=user.id)
+        gl.access_token = 'benchmark'
+        gl.account = RemoteAccount.create(user.id, 'benchmark', dict(
+            projects=dict(), last_sync=iso_utcnow()))
+        db.session.commit()
+
+        tracemalloc.start()
+        start = time.time()
+        gl.sync(hooks=False, full=True)
+        db.session.commit()
+        elapsed = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        db.session.remove()
+        db.drop_all()
+    server.shutdown()
+    return peak, elapsed
+
+
+def main(counts):
+    """Run the benchmark for all project counts."""
+    app = create_app()
+    print('{0:>10} {1:>12} {2:>10}'.format(
+        'projects', 'peak (MiB)', 'time (s)'))
+    for total in counts:
+        peak, elapsed = run(app, total)
+        print('{0:>10} {1:>12.1f} {2:>10.1f}'.format(
+            total, peak / 1024.0 / 1024.0, elapsed))
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [10000, 50000, 100000])
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Add claim token to invenio-gitlab releases."""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a8d2e5c7f3b0'
+down_revision = 'f1b9c6d4e2a7'
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade database."""
+    op.add_column('gitlab_releases',
+                  sa.Column('claim_token', sa.String(length=255),
+                            nullable=True))
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_column('gitlab_releases', 'claim_token')
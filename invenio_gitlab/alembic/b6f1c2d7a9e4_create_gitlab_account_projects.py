@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Create invenio-gitlab account projects table."""
+
+from datetime import datetime
+
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b6f1c2d7a9e4'
+down_revision = 'd3ba1d18340c'
+branch_labels = ()
+depends_on = None
+
+remote_accounts = sa.table(
+    'oauthclient_remoteaccount',
+    sa.column('id', sa.Integer),
+    sa.column('extra_data', sqlalchemy_utils.types.JSONType),
+)
+
+account_projects = sa.table(
+    'gitlab_account_projects',
+    sa.column('account_id', sa.Integer),
+    sa.column('gitlab_id', sa.Integer),
+    sa.column('full_name', sa.String),
+    sa.column('description', sa.Text),
+    sa.column('synced_at', sa.DateTime),
+)
+
+
+def _gitlab_accounts(connection):
+    """Yield remote accounts holding synced GitLab projects."""
+    for account_id, extra_data in connection.execute(
+            sa.select(remote_accounts.c.id, remote_accounts.c.extra_data)):
+        if extra_data and 'last_sync' in extra_data and \
+                isinstance(extra_data.get('projects'), dict):
+            yield account_id, extra_data
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        'gitlab_account_projects',
+        sa.Column('id', sa.Integer(), autoincrement=True),
+        sa.Column('account_id', sa.Integer(), nullable=False),
+        sa.Column('gitlab_id', sa.Integer(), nullable=False),
+        sa.Column('full_name', sa.String(length=255), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('synced_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.ForeignKeyConstraint(['account_id'],
+                                ['oauthclient_remoteaccount.id'],
+                                ondelete='CASCADE'),
+        sa.UniqueConstraint('account_id', 'gitlab_id'),
+    )
+    op.create_index(
+        'ix_gitlab_account_projects_full_name', 'gitlab_account_projects',
+        ['account_id', 'full_name'],
+    )
+
+    # Move the synced projects out of the remote account extra data.
+    connection = op.get_bind()
+    now = datetime.utcnow()
+    for account_id, extra_data in list(_gitlab_accounts(connection)):
+        projects = extra_data.pop('projects')
+        rows = [dict(
+            account_id=account_id,
+            gitlab_id=int(project['id']),
+            full_name=project['full_name'],
+            description=project.get('description'),
+            synced_at=now,
+        ) for project in projects.values()]
+        if rows:
+            connection.execute(account_projects.insert(), rows)
+        connection.execute(
+            remote_accounts.update()
+            .where(remote_accounts.c.id == account_id)
+            .values(extra_data=extra_data)
+        )
+
+
+def downgrade():
+    """Downgrade database."""
+    connection = op.get_bind()
+    account_ids = [account_id for account_id, in connection.execute(
+        sa.select(account_projects.c.account_id).distinct())]
+    for account_id in account_ids:
+        extra_data = connection.execute(
+            sa.select(remote_accounts.c.extra_data)
+            .where(remote_accounts.c.id == account_id)
+        ).scalar() or {}
+        rows = connection.execute(
+            sa.select(account_projects.c.gitlab_id,
+                      account_projects.c.full_name,
+                      account_projects.c.description)
+            .where(account_projects.c.account_id == account_id)
+        )
+        extra_data['projects'] = {
+            str(gitlab_id): dict(
+                id=gitlab_id, full_name=full_name, description=description)
+            for gitlab_id, full_name, description in rows
+        }
+        connection.execute(
+            remote_accounts.update()
+            .where(remote_accounts.c.id == account_id)
+            .values(extra_data=extra_data)
+        )
+
+    op.drop_index('ix_gitlab_account_projects_full_name',
+                  table_name='gitlab_account_projects')
+    op.drop_table('gitlab_account_projects')
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Create invenio-gitlab release archives table."""
+
+from datetime import datetime
+
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e7d3f0a25c61'
+down_revision = 'c4a8e2f19b3d'
+branch_labels = ()
+depends_on = '2e97565eba72'
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        'gitlab_release_archives',
+        sa.Column('created', sa.DateTime(), nullable=False,
+                  default=datetime.utcnow),
+        sa.Column('updated', sa.DateTime(), nullable=False,
+                  default=datetime.utcnow),
+        sa.Column('project_id', sqlalchemy_utils.types.uuid.UUIDType(),
+                  nullable=False),
+        sa.Column('commit_sha', sa.String(length=40), nullable=False),
+        sa.Column('archive_format', sa.String(length=16), nullable=False),
+        sa.Column('file_id', sqlalchemy_utils.types.uuid.UUIDType(),
+                  nullable=False),
+        sa.ForeignKeyConstraint(['project_id'], ['gitlab_projects.id'],
+                                ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['file_id'], ['files_files.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('project_id', 'commit_sha', 'archive_format'),
+    )
+    op.create_index(op.f('ix_gitlab_release_archives_file_id'),
+                    'gitlab_release_archives', ['file_id'], unique=False)
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_index(op.f('ix_gitlab_release_archives_file_id'),
+                  table_name='gitlab_release_archives')
+    op.drop_table('gitlab_release_archives')
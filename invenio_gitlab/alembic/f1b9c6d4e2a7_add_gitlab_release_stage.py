@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Add publish pipeline stage to invenio-gitlab releases."""
+
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f1b9c6d4e2a7'
+down_revision = 'e7d3f0a25c61'
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade database."""
+    op.add_column('gitlab_releases',
+                  sa.Column('stage', sa.String(length=32), nullable=True))
+    op.add_column('gitlab_releases',
+                  sa.Column('stage_data', sa.JSON().with_variant(
+                      sa.dialects.postgresql.JSON(none_as_null=True),
+                      'postgresql',
+                  ).with_variant(
+                      sqlalchemy_utils.types.JSONType(), 'sqlite'
+                  ).with_variant(
+                      sqlalchemy_utils.types.JSONType(), 'mysql'
+                  ), nullable=True))
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_column('gitlab_releases', 'stage_data')
+    op.drop_column('gitlab_releases', 'stage')
@@ -21,9 +21,14 @@
 
 from __future__ import absolute_import
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
 import gitlab
+from celery import group
 from flask import current_app
 from invenio_db import db
+from invenio_files_rest.models import Bucket, FileInstance, ObjectVersion
 from invenio_oauth2server.models import Token as ProviderToken
 from invenio_oauthclient.handlers import token_getter
 from invenio_oauthclient.models import RemoteAccount, RemoteToken
@@ -34,8 +39,25 @@ from six import string_types
 from werkzeug.local import LocalProxy
 from werkzeug.utils import cached_property, import_string
 
-from .models import Project, ReleaseStatus
-from .utils import get_extra_metadata, iso_utcnow, parse_timestamp, utcnow
+from .archive import ArchiveStream, SpooledArchive
+from .contributors import ContributorResolver
+from .errors import ReleaseArchiveError, ReleasePrefetchError, ReleaseStageError
+from .models import AccountProject, Project, Release, ReleaseArchive, ReleaseStatus
+from .proxies import current_gitlab
+from .tasks import sync_hooks
+from .utils import (
+    chunked,
+    get_extra_metadata,
+    iso_utcnow,
+    parse_timestamp,
+    utcnow,
+)
+
+SYNC_ACTIVITY_MARGIN = timedelta(hours=1)
+"""Overlap for incremental syncs.
+
+GitLab updates ``last_activity_at`` of a project at most once per hour.
+"""
 
 
 class GitLabAPI(object):
@@ -47,13 +69,17 @@ class GitLabAPI(object):
 
     @cached_property
     def api(self):
-        """Return an authenticated GitLab API."""
-        gl = gitlab.Gitlab(
-            current_app.config["GITLAB_BASE_URL"],
-            oauth_token=self.access_token,
+        """Return an authenticated GitLab API from the client pool."""
+        return current_gitlab.client_pool.get(
+            current_app.config["GITLAB_BASE_URL"], self.access_token
+        )
+
+    @cached_property
+    def user(self):
+        """Return the GitLab user owning the access token."""
+        return current_gitlab.client_pool.user(
+            current_app.config["GITLAB_BASE_URL"], self.access_token
         )
-        gl.auth()
-        return gl
 
     @cached_property
     def access_token(self):
@@ -102,7 +128,7 @@ class GitLabAPI(object):
 
     def init_account(self):
         """Setup a new GitLab account."""
-        gluser = self.api.user
+        gluser = self.user
         hook_token = ProviderToken.create_personal(
             "gitlab-webhook",
             self.user_id,
@@ -117,61 +143,125 @@ class GitLabAPI(object):
             tokens=dict(
                 webhook=hook_token.id,
             ),
-            projects=dict(),
             last_sync=iso_utcnow(),
         )
         db.session.add(self.account)
 
         self.sync(hooks=False)
 
-    def sync(self, hooks=True, async_hooks=True):
-        """Synchronize user projects."""
-        active_projects = {}
-        # Get user owned projects.
-        gitlab_projects = {
-            project.attributes["id"]: project.attributes
-            for project in self.api.projects.list(owned=True, simple=True)
-        }
-
-        for gl_project_id, gl_project in gitlab_projects.items():
-            active_projects[gl_project_id] = {
-                "id": gl_project_id,
-                "full_name": gl_project["path_with_namespace"],
-                "description": gl_project["description"],
+    def sync(self, hooks=True, async_hooks=True, full=None):
+        """Synchronize user projects.
+
+        The owned projects are cached in :class:`~.models.AccountProject`.
+        By default only projects with activity since the last sync are
+        fetched and merged into the cache. A full reconciliation, which also
+        detects deleted projects, runs once ``GITLAB_FULL_SYNC_TIMEDELTA`` has
+        passed since the previous one.
+
+        :param bool full: Force (``True``) or skip (``False``) the full
+            reconciliation.
+        """
+        extra_data = self.account.extra_data
+        chunk_size = current_app.config["GITLAB_SYNC_CHUNK_SIZE"]
+        if full is None:
+            full = self.check_full_sync()
+        if self.account.id is None:
+            db.session.flush()
+        account_id = self.account.id
+
+        list_params = dict(owned=True, simple=True, per_page=100)
+        if not full:
+            last_sync = parse_timestamp(extra_data["last_sync"])
+            list_params["last_activity_after"] = (
+                last_sync - SYNC_ACTIVITY_MARGIN
+            ).isoformat()
+
+        # Every project listed is stamped with the start of the sync, so the
+        # projects which are gone are found by the database.
+        start = datetime.utcnow()
+
+        # Consume the user owned projects page by page. The plain attributes
+        # are listed, as project objects reference each other through their
+        # managers and are only freed by the garbage collector.
+        gitlab_projects = self.api.http_list(
+            "/projects", query_data=list_params, iterator=True
+        )
+        for chunk in chunked(gitlab_projects, chunk_size):
+            projects = {
+                attrs["id"]: dict(
+                    full_name=attrs["path_with_namespace"],
+                    description=attrs["description"],
+                )
+                for attrs in chunk
             }
+            AccountProject.update_projects(account_id, projects, seen_at=start)
+            # Update changed names for projects stored in DB
+            Project.rename(
+                self.user_id,
+                {
+                    gitlab_id: project["full_name"]
+                    for gitlab_id, project in projects.items()
+                },
+            )
 
-        if hooks:
-            # TODO: Sync hooks here.
-            pass
-
-        # Update changed names for projects stored in DB
-        db_projects = Project.query.filter(
-            Project.user_id == self.user_id,
-            Project.gitlab_id.in_(gitlab_projects.keys()),
-        )
+        now = iso_utcnow()
+        if full:
+            # Remove ownership from projects, that the user no longer owns,
+            # or that have been deleted.
+            db.session.flush()
+            Project.disown(self.user_id, account_id, start)
+            AccountProject.prune(account_id, start)
+            extra_data["last_full_sync"] = now
+
+        # Update last sync
+        extra_data.pop("projects", None)
+        extra_data.pop("sync_requested", None)
+        extra_data["last_sync"] = now
+        extra_data.changed()
+        db.session.add(self.account)
 
-        for project in db_projects:
-            gl_project = gitlab_projects.get(project.gitlab_id)
-            if gl_project and project.name != gl_project["path_with_namespace"]:
-                project.name = gl_project.full_name
-                db.session.add(project)
-
-        # Remove ownership from projects, that the user no longer owns,
-        # or that have been deleted.
-        Project.query.filter(
-            Project.user_id == self.user_id,
-            ~Project.gitlab_id.in_(gitlab_projects.keys()),
-        ).update(dict(user_id=None, hook=None), synchronize_session=False)
-
-        # Update projects and last sync
-        self.account.extra_data.update(
-            dict(
-                projects=active_projects,
-                last_sync=iso_utcnow(),
+        if hooks:
+            project_hooks = db.session.query(Project.gitlab_id, Project.hook).filter(
+                Project.user_id == self.user_id,
+                Project.hook.isnot(None),
             )
-        )
-        self.account.extra_data.changed()
-        db.session.add(self.account)
+            if async_hooks:
+                chunks = chunked(map(tuple, project_hooks), chunk_size)
+                group(sync_hooks.s(self.user_id, chunk) for chunk in chunks).delay()
+            else:
+                self.check_hooks(project_hooks.all())
+
+    def check_hooks(self, project_hooks):
+        """Check installed webhooks and disable projects that lost them.
+
+        The hooks are fetched concurrently from GitLab. Projects whose hook
+        has been deleted or no longer points to :attr:`webhook_url` are
+        disabled. Hooks that could not be checked are left untouched.
+
+        :param project_hooks: List of ``(gitlab_id, hook_id)`` pairs.
+        """
+        api = self.api
+        webhook_url = self.webhook_url
+        workers = current_app.config["GITLAB_SYNC_HOOKS_WORKERS"]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    lambda project_hook: _check_hook(api, webhook_url, *project_hook),
+                    project_hooks,
+                )
+            )
+
+        missing = [
+            gitlab_id
+            for (gitlab_id, hook_id), valid in zip(project_hooks, results)
+            if valid is False
+        ]
+        for chunk in chunked(missing, current_app.config["GITLAB_SYNC_CHUNK_SIZE"]):
+            Project.query.filter(
+                Project.user_id == self.user_id,
+                Project.gitlab_id.in_(chunk),
+            ).update(dict(user_id=None, hook=None), synchronize_session=False)
+        return missing
 
     def check_sync(self):
         """Check if sync is required based on the last sync date."""
@@ -183,6 +273,35 @@ class GitLabAPI(object):
         last_sync = parse_timestamp(self.account.extra_data["last_sync"])
         return last_sync < expiration
 
+    @property
+    def sync_pending(self):
+        """Return True, if a background sync has been requested recently."""
+        requested = self.account.extra_data.get("sync_requested")
+        if not requested:
+            return False
+        timeout = current_app.config["GITLAB_SYNC_TASK_TIMEOUT"]
+        return parse_timestamp(requested) > utcnow() - timeout
+
+    def request_sync(self):
+        """Mark a background sync as requested.
+
+        :returns: False, if a background sync is already pending.
+        """
+        if self.sync_pending:
+            return False
+        self.account.extra_data["sync_requested"] = iso_utcnow()
+        self.account.extra_data.changed()
+        db.session.add(self.account)
+        return True
+
+    def check_full_sync(self):
+        """Check if the next sync has to be a full reconciliation."""
+        last_full_sync = self.account.extra_data.get("last_full_sync")
+        full_sync_td = current_app.config.get("GITLAB_FULL_SYNC_TIMEDELTA")
+        if not last_full_sync or not full_sync_td:
+            return True
+        return parse_timestamp(last_full_sync) < utcnow() - full_sync_td
+
     def create_hook(self, project_id, project_name):
         """Create project webhook."""
         attributes = {
@@ -241,12 +360,44 @@ class GitLabAPI(object):
         return False
 
 
+def _check_hook(api, webhook_url, gitlab_id, hook_id):
+    """Return whether a project hook exists and points to the webhook URL.
+
+    Returns ``None`` if GitLab could not be asked.
+    """
+    try:
+        hook = api.projects.get(gitlab_id, lazy=True).hooks.get(hook_id)
+    except gitlab.GitlabGetError as e:
+        if e.response_code == 404:
+            return False
+        return None
+    except (gitlab.GitlabError, IOError):
+        return None
+    return hook.attributes.get("url") == webhook_url
+
+
 class GitLabRelease(object):
     """A GitLab release."""
 
+    prefetch_fields = ("tag", "extra_metadata")
+    """Properties resolved concurrently with the GitLab API before publishing.
+
+    Subclasses add their own remote inputs, e.g. contributors, so they are
+    fetched in parallel with the others.
+    """
+
+    stages = ("resolve", "fetch_archive", "build_deposit", "publish", "finalise")
+    """Stages of the publish pipeline, in the order they run.
+
+    Each stage is implemented by the method ``stage_<name>`` and run by
+    :meth:`run_stage`.
+    """
+
     def __init__(self, release):
         """Init GitLab release."""
         self.model = release
+        self.remote_fields = set()
+        """Metadata fields which had to be resolved with the GitLab API."""
 
     @cached_property
     def gl(self):
@@ -272,12 +423,79 @@ class GitLabRelease(object):
         """Return release metadata."""
         return self.event.payload
 
+    @cached_property
+    def tag_name(self):
+        """Return the name of the released tag."""
+        return self.payload["ref"].split("refs/tags/")[1]
+
     @cached_property
     def tag(self):
-        """Return tag metadata."""
-        project = self.gl.api.projects.get(self.payload["project_id"])
-        tag = project.tags.get(self.payload["ref"].split("refs/tags/")[1])
-        return tag.attributes
+        """Return tag metadata.
+
+        The metadata is built from the webhook payload. The GitLab API is
+        only asked for the commit, if the payload does not include it.
+        """
+        for commit in self.payload.get("commits") or []:
+            if commit.get("id") == self.commit_sha and commit.get("timestamp"):
+                created_at = commit["timestamp"]
+                break
+        else:
+            created_at = self.commit["created_at"]
+            self.remote_fields.add("commit.created_at")
+        return dict(
+            name=self.tag_name,
+            commit=dict(id=self.commit_sha, created_at=created_at),
+        )
+
+    @cached_property
+    def gl_project(self):
+        """Return the handle of the released GitLab project.
+
+        The handle is created without a request and shared by everything
+        fetching objects of the project during the release, including the
+        helpers in :mod:`invenio_gitlab.utils`.
+        """
+        return self.gl.api.projects.get(self.payload["project_id"], lazy=True)
+
+    @cached_property
+    def previous_commit_sha(self):
+        """Return the commit of the previous published release, if any."""
+        previous = (
+            Release.query.filter(
+                Release.project_id == self.model.project_id,
+                Release.status == ReleaseStatus.PUBLISHED,
+                Release.id != self.model.id,
+            )
+            .order_by(Release.created.desc())
+            .first()
+        )
+        if previous is not None and previous.event is not None:
+            return previous.event.payload.get("checkout_sha")
+
+    @cached_property
+    def contributors(self):
+        """Return the contributors of the released commit."""
+        ttl = current_app.config["GITLAB_CONTRIBUTORS_CACHE_TTL"]
+        resolver = ContributorResolver(
+            self.gl_project,
+            current_gitlab.cache,
+            max_contributors=current_app.config["GITLAB_CONTRIBUTORS_MAX"],
+            ttl=ttl.total_seconds() if ttl else None,
+            ref=current_app.config["GITLAB_CONTRIBUTORS_REF"],
+        )
+        return [
+            dict(name=contributor["name"], affiliation="")
+            for contributor in resolver.resolve(
+                self.commit_sha, self.previous_commit_sha
+            )
+            if contributor["name"]
+        ]
+
+    @cached_property
+    def commit(self):
+        """Return the released commit from the GitLab API."""
+        # Requests pinned to a commit SHA are answered from the HTTP cache.
+        return self.gl_project.commits.get(self.commit_sha).attributes
 
     @cached_property
     def commit_sha(self):
@@ -317,7 +535,7 @@ class GitLabRelease(object):
     @cached_property
     def defaults(self):
         """Return default metadata."""
-        return dict(
+        defaults = dict(
             access_right="open",
             title=self.title,
             description=self.description,
@@ -327,6 +545,9 @@ class GitLabRelease(object):
             version=self.tag["name"],
             upload_type="software",
         )
+        if current_app.config["GITLAB_RELEASE_CONTRIBUTORS"] and self.contributors:
+            defaults["creators"] = self.contributors
+        return defaults
 
     @cached_property
     def extra_metadata(self):
@@ -334,17 +555,32 @@ class GitLabRelease(object):
         return get_extra_metadata(
             self.gl,
             self.payload["project_id"],
-            self.tag["name"],
+            self.commit_sha,
+            project=self.gl_project,
         )
 
+    @cached_property
+    def archive_format(self):
+        """Return the format of the repository archive."""
+        project = self.model.project
+        if project is not None and project.archive_format:
+            return project.archive_format
+        return current_app.config["GITLAB_ARCHIVE_FORMAT"]
+
+    @cached_property
+    def archive_mimetype(self):
+        """Return the MIME type of the repository archive."""
+        return current_app.config["GITLAB_ARCHIVE_FORMATS"].get(self.archive_format)
+
     @cached_property
     def filename(self):
         """Extract files to download from the GitLab payload."""
-        tag_name = self.event.payload["ref"].split("refs/tags/")[1]
         # Only use project part of path for filename
         project_name = self.project["path_with_namespace"].split("/")[-1]
 
-        filename = "{name}-{tag}.zip".format(name=project_name, tag=tag_name)
+        filename = "{name}-{tag}.{format}".format(
+            name=project_name, tag=self.tag_name, format=self.archive_format
+        )
 
         return filename
 
@@ -377,25 +613,294 @@ class GitLabRelease(object):
 
     def verify_sender(self):
         """Check if the sender is valid."""
-        return (
-            self.project["path_with_namespace"]
-            in self.gl.account.extra_data["projects"]
+        return db.session.query(
+            AccountProject.query.filter_by(
+                account_id=self.gl.account.id,
+                gitlab_id=self.payload["project_id"],
+            ).exists()
+        ).scalar()
+
+    def reuse_archive(self, deposit, fileinstance):
+        """Add an already stored archive to the deposit without copying it."""
+        files = deposit.files
+        obj = ObjectVersion.create(
+            files.bucket, self.filename, _file_id=fileinstance.id
+        )
+        files.filesmap[self.filename] = files.file_cls(obj, {}).dumps()
+        files.flush()
+        return obj
+
+    def verify_archive(self, fileinstance, archive):
+        """Check that the stored file matches the downloaded archive."""
+        spooled = self.spooled_archive
+        if spooled is not None and (spooled.size, spooled.checksum) != (
+            archive.size,
+            archive.checksum,
+        ):
+            raise ReleaseArchiveError(
+                "Spooled archive {0} changed while it was stored.".format(spooled.path)
+            )
+        algorithm = archive.checksum.split(":")[0]
+        if fileinstance.size != archive.size or (
+            fileinstance.checksum.startswith(algorithm + ":")
+            and fileinstance.checksum != archive.checksum
+        ):
+            raise ReleaseArchiveError(
+                "Stored archive {0} ({1} bytes, {2}) does not match the "
+                "downloaded archive ({3} bytes, {4}).".format(
+                    self.filename,
+                    fileinstance.size,
+                    fileinstance.checksum,
+                    archive.size,
+                    archive.checksum,
+                )
+            )
+
+    @cached_property
+    def spooled_archive(self):
+        """Return the on-disk spool of the archive, if spooling is enabled."""
+        if current_app.config["GITLAB_ARCHIVE_SPOOL"]:
+            return SpooledArchive(
+                self.gl_project,
+                self.commit_sha,
+                self.archive_format,
+                directory=current_app.config["GITLAB_ARCHIVE_SPOOL_DIR"],
+                chunk_size=current_app.config["GITLAB_ARCHIVE_CHUNK_SIZE"],
+                max_retries=current_app.config["GITLAB_ARCHIVE_MAX_RETRIES"],
+            )
+
+    @cached_property
+    def stored_archive(self):
+        """Return the already stored archive of the released commit, if any."""
+        if current_app.config["GITLAB_ARCHIVE_DEDUPLICATION"]:
+            return ReleaseArchive.get(
+                self.model.project_id, self.commit_sha, self.archive_format
+            )
+
+    def open_archive(self):
+        """Start streaming the repository archive from GitLab."""
+        if self.spooled_archive is not None:
+            return self.spooled_archive.open()
+        return ArchiveStream.from_project(
+            self.gl_project,
+            self.commit_sha,
+            chunk_size=current_app.config["GITLAB_ARCHIVE_CHUNK_SIZE"],
+            format=self.archive_format,
         )
 
+    def prefetch(self, archive=True):
+        """Fetch all remote inputs of the release concurrently.
+
+        The properties named in :attr:`prefetch_fields` are resolved and the
+        archive download is started in parallel, so the latency is that of
+        the slowest request. All failures are collected and raised together
+        as :class:`~invenio_gitlab.errors.ReleasePrefetchError`.
+
+        :param bool archive: Also start the archive download.
+        :returns: The opened :class:`~invenio_gitlab.archive.ArchiveStream`,
+            or ``None`` if the archive of the commit is already stored.
+        """
+        # Resolve everything needing the database in the current thread, as
+        # each worker gets its own application context and session. The
+        # cached properties keep the values for the workers.
+        for name in (
+            "payload",
+            "gl_project",
+            "archive_format",
+            "spooled_archive",
+            "stored_archive",
+            "previous_commit_sha",
+        ):
+            getattr(self, name)
+
+        app = current_app._get_current_object()
+
+        def resolve(name):
+            with app.app_context():
+                if name == "archive":
+                    return self.open_archive()
+                return getattr(self, name)
+
+        names = list(self.prefetch_fields)
+        if (
+            current_app.config["GITLAB_RELEASE_CONTRIBUTORS"]
+            and "contributors" not in names
+        ):
+            names.append("contributors")
+        if archive and self.stored_archive is None:
+            names.append("archive")
+        workers = current_app.config["GITLAB_PREFETCH_WORKERS"]
+        results, errors = {}, {}
+        with ThreadPoolExecutor(max_workers=min(workers, len(names))) as pool:
+            futures = [(name, pool.submit(resolve, name)) for name in names]
+            for name, future in futures:
+                try:
+                    results[name] = future.result()
+                except Exception as exc:
+                    errors[name] = exc
+        if errors:
+            if "archive" in results:
+                results["archive"].close()
+            raise ReleasePrefetchError(errors)
+        return results.get("archive")
+
     def publish(self):
         """Publish GitLab release as a record."""
+        archive = self.prefetch()
+        try:
+            self._publish(archive)
+        finally:
+            if archive is not None:
+                archive.close()
+        # Failed releases keep the spooled archive to resume from it.
+        if self.spooled_archive is not None:
+            self.spooled_archive.remove()
+
+    def _publish(self, archive):
+        """Create and publish the deposit of the prefetched release."""
         with db.session.begin_nested():
             deposit = self.deposit_class.create(self.metadata)
             deposit["_deposit"]["created_by"] = self.event.user_id
             deposit["_deposit"]["owners"] = [self.event.user_id]
+            current_app.logger.info(
+                "Release %s: metadata fields resolved with the GitLab API: %s",
+                self.model.id,
+                ", ".join(sorted(self.remote_fields)) or "none",
+            )
+
+            if archive is None:
+                obj = self.reuse_archive(deposit, self.stored_archive)
+            else:
+                # Stream the repository archive into the files storage.
+                deposit.files[self.filename] = archive
+                obj = deposit.files[self.filename].obj
+                self.register_archive(obj, archive)
+            if self.archive_mimetype:
+                obj.mimetype = self.archive_mimetype
 
-            # Fetch the deposit files
-            project = self.gl.api.projects.get(self.payload["project_id"])
-            deposit.files[self.filename] = project.repository_archive(
-                sha=self.commit_sha,
-                streamed=True,
+            deposit.publish()
+            recid, record = deposit.fetch_published()
+            self.model.recordmetadata = record.model
+
+    def register_archive(self, obj, archive):
+        """Verify a freshly stored archive and index it for reuse."""
+        self.verify_archive(obj.file, archive)
+        if current_app.config["GITLAB_ARCHIVE_DEDUPLICATION"]:
+            ReleaseArchive.create(
+                self.model.project_id,
+                self.commit_sha,
+                self.archive_format,
+                obj.file.id,
             )
 
+    @property
+    def stage_data(self):
+        """Return the results of the completed pipeline stages."""
+        return self.model.stage_data or {}
+
+    def run_stage(self, stage):
+        """Run a stage of the publish pipeline, unless it has completed.
+
+        The results of the stage and its name are saved on the release, so
+        a failed pipeline resumes after the last completed stage.
+
+        :param str stage: Name of the stage, see :attr:`stages`.
+        :returns: ``True`` if the stage has been run.
+        """
+        index = self.stages.index(stage)
+        if (
+            self.model.stage is not None
+            and self.stages.index(self.model.stage) >= index
+        ):
+            return False
+        if index > 0 and self.model.stage != self.stages[index - 1]:
+            raise ReleaseStageError(
+                "Stage {0} of {1} cannot run before stage {2}.".format(
+                    stage, self.model, self.stages[index - 1]
+                )
+            )
+        data = getattr(self, "stage_" + stage)()
+        self.model.stage_data = dict(self.stage_data, **(data or {}))
+        self.model.stage = stage
+        return True
+
+    def stage_resolve(self):
+        """Resolve the metadata of the release."""
+        self.prefetch(archive=False)
+        return dict(metadata=self.metadata, remote_fields=sorted(self.remote_fields))
+
+    def stage_fetch_archive(self):
+        """Store the repository archive in a staging bucket.
+
+        The stored archive is kept until the release is finalised, so later
+        stages never download it again.
+        """
+        if self.stored_archive is not None:
+            return dict(file_id=str(self.stored_archive.id))
+        archive = self.open_archive()
+        try:
+            with db.session.begin_nested():
+                bucket = Bucket.create()
+                obj = ObjectVersion.create(bucket, self.filename, stream=archive)
+                self.register_archive(obj, archive)
+        finally:
+            archive.close()
+        return dict(file_id=str(obj.file.id), bucket_id=str(bucket.id))
+
+    def stage_build_deposit(self):
+        """Create the deposit with the metadata and the stored archive."""
+        fileinstance = FileInstance.query.get(self.stage_data["file_id"])
+        if fileinstance is None or not fileinstance.readable:
+            raise ReleaseArchiveError(
+                "Stored archive of {0} is no longer available.".format(self.model)
+            )
+        with db.session.begin_nested():
+            deposit = self.deposit_class.create(self.stage_data["metadata"])
+            deposit["_deposit"]["created_by"] = self.event.user_id
+            deposit["_deposit"]["owners"] = [self.event.user_id]
+            current_app.logger.info(
+                "Release %s: metadata fields resolved with the GitLab API: %s",
+                self.model.id,
+                ", ".join(self.stage_data["remote_fields"]) or "none",
+            )
+            obj = self.reuse_archive(deposit, fileinstance)
+            if self.archive_mimetype:
+                obj.mimetype = self.archive_mimetype
+        return dict(deposit_id=str(deposit.id))
+
+    def stage_publish(self):
+        """Publish the deposit and link the record to the release."""
+        deposit = self.deposit_class.get_record(self.stage_data["deposit_id"])
+        with db.session.begin_nested():
             deposit.publish()
             recid, record = deposit.fetch_published()
             self.model.recordmetadata = record.model
+
+    def stage_finalise(self):
+        """Mark the release as published and drop the staged archive."""
+        self.discard_staged_archive()
+        self.model.status = ReleaseStatus.PUBLISHED
+
+    def discard_staged_archive(self):
+        """Remove the staging bucket and the spooled archive of the release.
+
+        A release whose deposit has not been built yet goes back to the
+        ``resolve`` stage, so it stores the archive again when it is
+        processed again. Its spooled archive is kept, so the download is
+        resumed instead, and is otherwise left to
+        :meth:`~invenio_gitlab.archive.SpooledArchive.sweep`.
+        """
+        data = dict(self.stage_data)
+        bucket_id = data.pop("bucket_id", None)
+        bucket = Bucket.get(bucket_id) if bucket_id else None
+        if bucket is not None:
+            bucket.remove()
+        stored = self.model.stage is not None and self.stages.index(
+            self.model.stage
+        ) > self.stages.index("fetch_archive")
+        if self.model.stage == "fetch_archive":
+            data.pop("file_id", None)
+            self.model.stage = "resolve"
+        self.model.stage_data = data
+        if stored and self.spooled_archive is not None:
+            self.spooled_archive.remove()
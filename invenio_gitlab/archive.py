@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Streaming of repository archives into the files storage."""
+
+from __future__ import absolute_import
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import requests
+from flask import current_app
+from gitlab import GitlabHttpError
+
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+"""Errors after which an interrupted download is resumed."""
+
+
+class ArchiveStream(object):
+    """Read-only file-like object over the chunks of a repository archive.
+
+    The storage backend pulls the archive with :meth:`read` while it is
+    downloaded from GitLab, so at most one storage chunk and one network chunk
+    are held in memory at a time. The MD5 checksum and the size of the
+    archive are computed on the fly.
+
+    :param chunks: Iterable of byte strings, e.g. the response iterator of
+        ``project.repository_archive(iterator=True)``.
+    """
+
+    def __init__(self, chunks):
+        """Initialize the stream."""
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    @classmethod
+    def from_project(cls, project, sha, chunk_size, **kwargs):
+        """Start streaming the archive of a project at a commit."""
+        return cls(
+            project.repository_archive(
+                sha=sha, streamed=True, iterator=True, chunk_size=chunk_size, **kwargs
+            )
+        )
+
+    @property
+    def checksum(self):
+        """Checksum of the bytes read so far, in the files storage format."""
+        return "md5:{0}".format(self._md5.hexdigest())
+
+    def _fill(self, size):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                break
+            self._buffer += chunk
+
+    def read(self, size=-1):
+        """Read up to ``size`` bytes, or the rest of the archive."""
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer = bytearray()
+        else:
+            with memoryview(self._buffer) as view:
+                data = bytes(view[:size])
+            del self._buffer[:size]
+        self._md5.update(data)
+        self.size += len(data)
+        return data
+
+    def readable(self):
+        """Return True."""
+        return True
+
+    def close(self):
+        """Drop the buffer and stop reading the archive."""
+        self._buffer = bytearray()
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def _read_file(path, chunk_size):
+    """Yield the content of a file in chunks."""
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            yield chunk
+
+
+class _FileChunks(object):
+    """Iterator over the chunks of an open file, closing it on ``close``."""
+
+    def __init__(self, fp, chunk_size):
+        """Initialize the iterator."""
+        self.fp = fp
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        """Return the iterator."""
+        return self
+
+    def __next__(self):
+        """Return the next chunk."""
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            raise StopIteration
+        return chunk
+
+    next = __next__
+
+    def close(self):
+        """Close the file."""
+        self.fp.close()
+
+
+class SpooledArchive(object):
+    """Repository archive downloaded to a local file before it is stored.
+
+    The archive is written to ``<name>.part`` next to a JSON checkpoint with
+    the downloaded offset and the ``ETag`` of the archive. After a transient
+    error the download is resumed with an HTTP range request. ``If-Range``
+    makes GitLab send the whole archive again if it has changed, and servers
+    ignoring ranges are handled the same way. The file names only depend on
+    the project, commit and format, so a retried task resumes the download
+    of a previous attempt on the same host.
+
+    :param project: Handle of the GitLab project.
+    :param str sha: Commit SHA of the archive.
+    :param str archive_format: Archive format, e.g. ``"zip"``.
+    :param str directory: Spool directory. Defaults to the system temporary
+        directory.
+    :param int chunk_size: Size in bytes of the downloaded chunks.
+    :param int max_retries: Number of resumptions after transient errors.
+    :param sleep: Function used to wait between retries, replaceable for
+        testing.
+    """
+
+    checkpoint_interval = 16 * 1024 * 1024
+    """Bytes downloaded between two checkpoints."""
+
+    def __init__(
+        self,
+        project,
+        sha,
+        archive_format,
+        directory=None,
+        chunk_size=1024 * 1024,
+        max_retries=5,
+        sleep=time.sleep,
+    ):
+        """Initialize the archive."""
+        self.project = project
+        self.sha = sha
+        self.archive_format = archive_format
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.path = os.path.join(
+            directory or tempfile.gettempdir(),
+            "invenio-gitlab-{0}-{1}.{2}".format(project.id, sha, archive_format),
+        )
+        self.partial = self.path + ".part"
+        self.checkpoint = self.path + ".json"
+        self.lockfile = self.path + ".lock"
+        self.size = None
+        self.checksum = None
+
+    @contextmanager
+    def _lock(self):
+        """Hold the exclusive lock of the spool."""
+        while True:
+            fp = open(self.lockfile, "a")
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                # Retry if the lock file was removed while waiting for it.
+                if os.fstat(fp.fileno()).st_ino == os.stat(self.lockfile).st_ino:
+                    break
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    fp.close()
+                    raise
+            fp.close()
+        try:
+            yield
+        finally:
+            fp.close()
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint) as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_checkpoint(self, **state):
+        with open(self.checkpoint + ".tmp", "w") as fp:
+            json.dump(state, fp)
+        os.rename(self.checkpoint + ".tmp", self.checkpoint)
+
+    def _request(self, offset, etag):
+        """Request the archive from ``offset`` on."""
+        headers = {}
+        if offset:
+            headers["Range"] = "bytes={0}-".format(offset)
+            if etag:
+                headers["If-Range"] = etag
+        path = "/projects/{0}/repository/archive.{1}".format(
+            self.project.encoded_id, self.archive_format
+        )
+        return self.project.manager.gitlab.http_get(
+            path,
+            query_data=dict(sha=self.sha),
+            raw=True,
+            streamed=True,
+            retry_transient_errors=True,
+            extra_headers=headers,
+        )
+
+    def _fetch(self):
+        """Download the rest of the archive."""
+        state = self._load_checkpoint()
+        etag = state.get("etag")
+        offset = os.path.getsize(self.partial) if os.path.exists(self.partial) else 0
+        try:
+            response = self._request(offset, etag)
+        except GitlabHttpError as exc:
+            if exc.response_code != 416:
+                raise
+            # The partial file does not fit the archive, start over.
+            response = self._request(0, None)
+        try:
+            if response.status_code != 206:
+                offset = 0
+                etag = response.headers.get("ETag")
+            with open(self.partial, "ab" if offset else "wb") as fp:
+                checkpoint = offset
+                try:
+                    for chunk in response.iter_content(self.chunk_size):
+                        fp.write(chunk)
+                        offset += len(chunk)
+                        if offset - checkpoint >= self.checkpoint_interval:
+                            fp.flush()
+                            self._save_checkpoint(offset=offset, etag=etag)
+                            checkpoint = offset
+                finally:
+                    fp.flush()
+                    self._save_checkpoint(offset=offset, etag=etag)
+        finally:
+            response.close()
+
+    def download(self):
+        """Download the archive, resuming it after transient errors."""
+        with self._lock():
+            self._download()
+
+    def _download(self):
+        state = self._load_checkpoint()
+        if os.path.exists(self.path) and state.get("checksum"):
+            self.size, self.checksum = state["size"], state["checksum"]
+            return
+        attempt = 0
+        while True:
+            try:
+                self._fetch()
+                break
+            except TRANSIENT_ERRORS as exc:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                current_app.logger.warning(
+                    "Resuming download of %s after error: %s", self.path, exc
+                )
+                self.sleep(min(2**attempt, 60))
+
+        # The archive is only stored once it is complete and checksummed.
+        md5 = hashlib.md5()
+        for chunk in _read_file(self.partial, self.chunk_size):
+            md5.update(chunk)
+        self.size = os.path.getsize(self.partial)
+        self.checksum = "md5:{0}".format(md5.hexdigest())
+        os.rename(self.partial, self.path)
+        self._save_checkpoint(size=self.size, checksum=self.checksum)
+
+    def open(self):
+        """Download the archive if needed and return a stream of it."""
+        with self._lock():
+            self._download()
+            fp = open(self.path, "rb")
+        return ArchiveStream(_FileChunks(fp, self.chunk_size))
+
+    def remove(self):
+        """Delete the downloaded archive and its checkpoint."""
+        with self._lock():
+            # Tasks waiting for the removed lock file lock a new one.
+            for path in (self.path, self.partial, self.checkpoint, self.lockfile):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    @classmethod
+    def sweep(cls, directory=None, max_age=None):
+        """Delete spooled archives which have not been touched for a while.
+
+        Spools of failed releases are kept to resume them, so they have to
+        be removed eventually.
+
+        :param str directory: Spool directory.
+        :param max_age: :class:`~datetime.timedelta` since the last change
+            of a spool after which it is deleted.
+        :returns: Number of deleted spools.
+        """
+        directory = directory or tempfile.gettempdir()
+        cutoff = time.time() - max_age.total_seconds()
+        removed = 0
+        for name in os.listdir(directory):
+            if not name.startswith("invenio-gitlab-") or not name.endswith(".lock"):
+                continue
+            lockfile = os.path.join(directory, name)
+            base = lockfile[: -len(".lock")]
+            paths = [base, base + ".part", base + ".json"]
+            with open(lockfile, "a") as fp:
+                try:
+                    fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    continue
+                mtimes = [
+                    os.path.getmtime(path)
+                    for path in paths + [lockfile]
+                    if os.path.exists(path)
+                ]
+                if max(mtimes) >= cutoff:
+                    continue
+                for path in paths + [lockfile]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                removed += 1
+        return removed
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Caches used by Invenio-GitLab."""
+
+from __future__ import absolute_import
+
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+def sizeof(value):
+    """Estimate the memory used by a value of plain Python types in bytes."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item) for item in value)
+    return size
+
+
+class LRUCache(object):
+    """Thread-safe mapping with LRU eviction and per-entry expiry.
+
+    :param int maxsize: Maximum number of entries kept in the cache.
+    :param float ttl: Seconds after which an entry expires. ``None`` disables
+        expiry.
+    :param timer: Monotonic clock, replaceable for testing.
+    :param int maxbytes: Maximum total size of the values, measured with
+        ``getsizeof``. ``None`` disables the limit.
+    :param getsizeof: Function returning the size of a value in bytes.
+    """
+
+    def __init__(
+        self,
+        maxsize=128,
+        ttl=None,
+        timer=time.monotonic,
+        maxbytes=None,
+        getsizeof=sizeof,
+    ):
+        """Initialize the cache."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.maxbytes = maxbytes
+        self.getsizeof = getsizeof
+        self.currbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, key):
+        expires, value, size = self._data.pop(key)
+        self.currbytes -= size
+        return value
+
+    def get(self, key, default=None):
+        """Return the cached value or ``default`` if missing or expired."""
+        with self._lock:
+            try:
+                expires, value, size = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires <= self.timer():
+                self._remove(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entries.
+
+        Values larger than ``maxbytes`` are not stored.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = self.timer() + ttl if ttl is not None else None
+        size = self.getsizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (expires, value, size)
+            self.currbytes += size
+            while len(self._data) > self.maxsize or (
+                self.maxbytes is not None and self.currbytes > self.maxbytes
+            ):
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        """Remove an entry and return its value."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+            self.currbytes = 0
+
+    def __len__(self):
+        """Return the number of stored entries, including expired ones."""
+        return len(self._data)
+
+
+class MemoryCache(object):
+    """Size-bounded cache backend local to the current process.
+
+    Without arguments, the limits are ``GITLAB_CACHE_SIZE`` and
+    ``GITLAB_CACHE_MAX_BYTES``.
+
+    :param int maxsize: Maximum number of entries.
+    :param int maxbytes: Maximum total size of the cached values in bytes.
+    """
+
+    def __init__(self, maxsize=None, maxbytes=None):
+        """Initialize the backend."""
+        if maxsize is None:
+            maxsize = current_app.config["GITLAB_CACHE_SIZE"]
+            maxbytes = current_app.config["GITLAB_CACHE_MAX_BYTES"]
+        self._cache = LRUCache(maxsize=maxsize, maxbytes=maxbytes)
+
+    def get(self, key):
+        """Return the cached value or ``None``."""
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        """Store a value for ``ttl`` seconds."""
+        self._cache.set(key, value, ttl=ttl)
+
+    def delete(self, key):
+        """Remove a value."""
+        self._cache.pop(key)
+
+
+class RedisCache(object):
+    """Cache backend shared by all processes through Redis.
+
+    Values are pickled, so they must only contain plain Python types.
+
+    :param str url: Redis URL. Defaults to ``GITLAB_CACHE_REDIS_URL``, or
+        ``CACHE_REDIS_URL`` if the former is not set.
+    :param str prefix: Prefix of all keys stored by this backend.
+    """
+
+    def __init__(self, url=None, prefix="invenio_gitlab:"):
+        """Initialize the backend."""
+        import redis
+
+        url = (
+            url
+            or current_app.config.get("GITLAB_CACHE_REDIS_URL")
+            or current_app.config["CACHE_REDIS_URL"]
+        )
+        self.prefix = prefix
+        self._redis = redis.StrictRedis.from_url(url)
+
+    def get(self, key):
+        """Return the cached value or ``None``."""
+        value = self._redis.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        """Store a value for ``ttl`` seconds."""
+        self._redis.set(
+            self.prefix + key,
+            pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+            ex=int(ttl) if ttl else None,
+        )
+
+    def delete(self, key):
+        """Remove a value."""
+        self._redis.delete(self.prefix + key)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Pooled GitLab API clients."""
+
+from __future__ import absolute_import
+
+import hashlib
+import re
+import threading
+
+import gitlab
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from six.moves.urllib_parse import parse_qs, urlsplit
+
+from .cache import LRUCache
+
+COMMIT_SHA = re.compile(r"^[0-9a-f]{40}$")
+"""Full commit SHA, which always refers to the same repository content."""
+
+IMMUTABLE_ENDPOINTS = (
+    (re.compile(r"^blobs/[0-9a-f]{40}(/raw)?$"), None),
+    (re.compile(r"^commits/[0-9a-f]{40}$"), None),
+    (re.compile(r"^tree$"), "ref"),
+    (re.compile(r"^files/[^/]+/raw$"), "ref"),
+    (re.compile(r"^archive(\.[a-z0-9.]+)?$"), "sha"),
+)
+"""Content-addressed repository endpoints, with the parameter pinning them.
+
+The path below ``/repository/`` must match, and the parameter, if any, must be
+a full commit SHA. Other endpoints, e.g. the statuses of a commit, change
+over time.
+"""
+
+CREDENTIAL_HEADERS = ("Authorization", "PRIVATE-TOKEN", "JOB-TOKEN")
+"""Request headers identifying the user of a request."""
+
+UNCACHED_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+"""Response headers not restored for cached responses."""
+
+PAGINATION_PARAMS = ("page", "per_page", "pagination")
+"""Request parameters of paginated lists."""
+
+PAGINATION_HEADERS = ("X-Per-Page", "Link")
+"""Response headers sent by GitLab with the pages of a list."""
+
+
+def _is_immutable(url, params):
+    """Return True, if a request to a content-addressed endpoint is pinned."""
+    path = urlsplit(url).path
+    if "/repository/" not in path:
+        return False
+    endpoint = path.split("/repository/", 1)[1]
+    for pattern, name in IMMUTABLE_ENDPOINTS:
+        if not pattern.match(endpoint):
+            continue
+        if name is None:
+            return True
+        value = (params or {}).get(name)
+        if isinstance(value, (list, tuple)):
+            value = value[0] if len(value) == 1 else None
+        return bool(value) and bool(COMMIT_SHA.match(str(value)))
+    return False
+
+
+def _is_paginated(url, params, response):
+    """Return True, if a response is a page of a list."""
+    names = set(params or {}) | set(parse_qs(urlsplit(url).query))
+    if names.intersection(PAGINATION_PARAMS):
+        return True
+    return any(name in response.headers for name in PAGINATION_HEADERS)
+
+
+class GitLabSession(requests.Session):
+    """HTTP session answering read-only GitLab requests from a cache.
+
+    Successful ``GET`` responses are stored with their ``ETag`` and
+    ``Last-Modified`` headers and revalidated with ``If-None-Match`` and
+    ``If-Modified-Since``. Responses of content-addressed repository requests
+    pinned to a full commit SHA (see :data:`IMMUTABLE_ENDPOINTS`) never change
+    and are served from the cache without asking GitLab. Cache keys include the credentials of the request, so responses
+    are never shared between users. Pages of lists are not cached, unless
+    they are pinned to a commit SHA.
+
+    Requests which reach GitLab are throttled by a shared
+    :class:`~invenio_gitlab.ratelimit.RateLimiter` per token and instance.
+
+    :param cache: Cache backend, see :mod:`invenio_gitlab.cache`.
+    :param float ttl: Seconds for which responses are kept in the cache.
+    :param int max_item_size: Responses with larger bodies are not cached.
+    :param rate_limiter: Rate limiter applied to all requests.
+    """
+
+    def __init__(
+        self, cache=None, ttl=None, max_item_size=512 * 1024, rate_limiter=None
+    ):
+        """Initialize the session."""
+        super(GitLabSession, self).__init__()
+        self.cache = cache
+        self.ttl = ttl
+        self.max_item_size = max_item_size
+        self.rate_limiter = rate_limiter
+
+    def credentials(self, url, headers, auth=None):
+        """Return a digest of the URL host and the credentials of a request."""
+        # Apply the authentication of the request to learn its credentials.
+        prepared = requests.Request(
+            "GET", url, headers=headers, auth=auth or self.auth
+        ).prepare()
+        parts = [urlsplit(url).netloc]
+        parts += [prepared.headers.get(name, "") for name in CREDENTIAL_HEADERS]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def cache_key(self, url, params, credentials):
+        """Return the cache key of a request."""
+        parts = [credentials, url, repr(sorted((params or {}).items()))]
+        digest = hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+        return "http:" + digest
+
+    def send_request(self, credentials, method, url, **kwargs):
+        """Send a request to GitLab, waiting for the rate limit if needed."""
+        if self.rate_limiter is None:
+            return super(GitLabSession, self).request(method, url, **kwargs)
+        self.rate_limiter.acquire(credentials)
+        response = super(GitLabSession, self).request(method, url, **kwargs)
+        self.rate_limiter.update(credentials, response)
+        return response
+
+    @staticmethod
+    def cached_response(entry, url):
+        """Build a response object from a cache entry."""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = url
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["content"]
+        response.encoding = entry["encoding"]
+        return response
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        """Send a request, using the cache for ``GET`` requests."""
+        credentials = None
+        if self.cache is not None or self.rate_limiter is not None:
+            credentials = self.credentials(url, headers, kwargs.get("auth"))
+        if self.cache is None or method.upper() != "GET" or kwargs.get("stream"):
+            return self.send_request(
+                credentials, method, url, params=params, headers=headers, **kwargs
+            )
+
+        key = self.cache_key(url, params, credentials)
+        entry = self.cache.get(key)
+        immutable = _is_immutable(url, params)
+        if entry is not None and immutable:
+            return self.cached_response(entry, url)
+
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.send_request(
+            credentials, method, url, params=params, headers=headers, **kwargs
+        )
+        if response.status_code == 304 and entry is not None:
+            return self.cached_response(entry, url)
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if (
+            response.status_code == 200
+            and (etag or last_modified or immutable)
+            and (immutable or not _is_paginated(url, params, response))
+            and len(response.content) <= self.max_item_size
+        ):
+            self.cache.set(
+                key,
+                dict(
+                    headers={
+                        k: v
+                        for k, v in response.headers.items()
+                        if k.lower() not in UNCACHED_HEADERS
+                    },
+                    content=response.content,
+                    encoding=response.encoding,
+                    etag=etag,
+                    last_modified=last_modified,
+                ),
+                ttl=self.ttl,
+            )
+        return response
+
+
+class GitLabClientPool(object):
+    """Process-wide pool of GitLab clients.
+
+    Clients are keyed by ``(base_url, access_token)``. All clients talking to
+    the same GitLab instance share one keep-alive :class:`requests.Session`,
+    so TLS connections survive across Flask requests and Celery tasks.
+
+    :param int maxsize: Maximum number of clients kept in the pool.
+    :param float ttl: Seconds after which a pooled client is discarded.
+    :param int connections: Size of the connection pool of each session.
+    :param bool lazy_auth: Skip the ``/user`` request when creating a client
+        and resolve the current user only when :meth:`user` is called.
+    :param float user_ttl: Seconds for which the resolved user of a token is
+        cached.
+    :param dict session_options: Keyword arguments for the
+        :class:`GitLabSession` of each instance.
+    """
+
+    def __init__(
+        self,
+        maxsize=256,
+        ttl=None,
+        connections=10,
+        lazy_auth=False,
+        user_ttl=None,
+        session_options=None,
+    ):
+        """Initialize the pool."""
+        self.connections = connections
+        self.lazy_auth = lazy_auth
+        self.session_options = session_options or {}
+        self._clients = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._users = LRUCache(maxsize=maxsize, ttl=user_ttl)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, base_url):
+        """Return the shared HTTP session for a GitLab instance."""
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = GitLabSession(**self.session_options)
+                adapter = HTTPAdapter(
+                    pool_connections=self.connections,
+                    pool_maxsize=self.connections,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[base_url] = session
+            return session
+
+    def get(self, base_url, access_token):
+        """Return a pooled client, creating it if needed."""
+        key = (base_url, access_token)
+        client = self._clients.get(key)
+        if client is None:
+            client = gitlab.Gitlab(
+                base_url,
+                oauth_token=access_token,
+                session=self.session(base_url),
+            )
+            if not self.lazy_auth:
+                client.auth()
+            self._clients.set(key, client)
+        return client
+
+    def user(self, base_url, access_token):
+        """Return the GitLab user owning the token."""
+        key = (base_url, access_token)
+        user = self._users.get(key)
+        if user is None:
+            client = self.get(base_url, access_token)
+            if client.user is None:
+                client.auth()
+            user = client.user
+            self._users.set(key, user)
+        return user
+
+    def discard(self, base_url, access_token):
+        """Drop a client, e.g. after its token has been revoked."""
+        self._clients.pop((base_url, access_token))
+        self._users.pop((base_url, access_token))
+
+    def clear(self):
+        """Drop all clients and close the shared sessions."""
+        self._clients.clear()
+        self._users.clear()
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
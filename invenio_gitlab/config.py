@@ -42,9 +42,276 @@ development and integration servers.
 GITLAB_METADATA_FILE = '.invenio.json'
 """File with extra metadata stored in the root of the imported repository."""
 
+GITLAB_METADATA_FILE_MAX_SIZE = 1024 * 1024
+"""Size in bytes of the largest accepted metadata file."""
+
+GITLAB_METADATA_CACHE_TTL = timedelta(days=7)
+"""Time period for which the metadata of a release commit is cached."""
+
 GITLAB_REFRESH_TIMEDELTA = timedelta(days=1)
 """Time period after which a GitLab account sync should be initiated."""
 
+GITLAB_CLIENT_POOL_SIZE = 256
+"""Maximum number of authenticated GitLab clients kept per process."""
+
+GITLAB_CLIENT_POOL_TTL = timedelta(minutes=30)
+"""Time period after which a pooled GitLab client is re-created."""
+
+GITLAB_HTTP_POOL_CONNECTIONS = 10
+"""Number of keep-alive connections per GitLab instance and process."""
+
+GITLAB_CACHE_BACKEND = 'invenio_gitlab.cache:MemoryCache'
+"""Cache backend class, instantiated without arguments.
+
+Use ``'invenio_gitlab.cache:RedisCache'`` to share cached GitLab responses
+between all web and worker processes.
+"""
+
+GITLAB_CACHE_SIZE = 1024
+"""Maximum number of entries of the in-process cache backend."""
+
+GITLAB_CACHE_MAX_BYTES = 32 * 1024 * 1024
+"""Maximum size in bytes of the values in the in-process cache backend.
+
+The in-process cache holds GitLab API responses, metadata files, contributors
+and repository sizes. Every web and worker process has its own cache, so with
+the default backend each process uses up to this much memory for it. Use
+:class:`~invenio_gitlab.cache.RedisCache` to share one cache instead.
+"""
+
+GITLAB_CACHE_REDIS_URL = None
+"""Redis URL of the shared cache and rate limit backends.
+
+Defaults to ``CACHE_REDIS_URL``.
+"""
+
+GITLAB_HTTP_CACHE = True
+"""Cache read-only GitLab API responses and revalidate them with ETags.
+
+Responses of paginated lists are not cached, as their parameters, e.g. the
+``last_activity_after`` of the project sync, rarely repeat. The cached
+responses count towards ``GITLAB_CACHE_MAX_BYTES``.
+"""
+
+GITLAB_HTTP_CACHE_TTL = timedelta(days=1)
+"""Time period for which GitLab API responses are kept in the cache."""
+
+GITLAB_HTTP_CACHE_MAX_ITEM_SIZE = 512 * 1024
+"""Size in bytes of the largest GitLab API response stored in the cache."""
+
+GITLAB_RATE_LIMIT = (2000, timedelta(minutes=1))
+"""Requests per time period which may be sent to GitLab with one token.
+
+Requests are throttled to this rate and to the ``RateLimit-Remaining`` and
+``RateLimit-Reset`` headers sent by GitLab. Set to ``None`` to disable
+throttling.
+"""
+
+GITLAB_RATE_LIMIT_BURST = 100
+"""Requests which may be sent at once after a token has been idle."""
+
+GITLAB_RATE_LIMIT_BACKEND = 'invenio_gitlab.ratelimit:MemoryRateLimitBackend'
+"""Storage of the rate limit buckets, instantiated without arguments.
+
+Use ``'invenio_gitlab.ratelimit:RedisRateLimitBackend'`` to share the buckets
+between all web and worker processes.
+"""
+
+GITLAB_LAZY_AUTH = False
+"""Only look up the current GitLab user when it is actually needed.
+
+When enabled, pooled clients are created without the ``/user`` request and
+the user is resolved once per token when setting up an account.
+"""
+
+GITLAB_USER_CACHE_TTL = timedelta(minutes=10)
+"""Time period for which the GitLab user of an access token is cached."""
+
+GITLAB_FULL_SYNC_TIMEDELTA = timedelta(days=7)
+"""Time period after which a sync lists all projects of an account.
+
+Syncs in between only fetch projects with recent activity. A full sync also
+detects projects that have been deleted or transferred. If set to ``None``,
+every sync is a full sync.
+"""
+
+GITLAB_BACKGROUND_SYNC = False
+"""Synchronize GitLab accounts in a Celery task instead of the settings view.
+
+When enabled, the settings page renders the stored projects right away and
+shows a "refreshing" state while a background sync is running. Only the
+first sync of a newly connected account is done synchronously.
+"""
+
+GITLAB_SYNC_TASK_TIMEOUT = timedelta(minutes=10)
+"""Time period after which a pending background sync may be requested again."""
+
+GITLAB_SYNC_CHUNK_SIZE = 500
+"""Number of projects reconciled with the database at once during a sync."""
+
+GITLAB_SYNC_HOOKS_WORKERS = 8
+"""Number of webhooks checked concurrently during a sync."""
+
+GITLAB_RELEASE_CONTRIBUTORS = False
+"""Add the contributors of the released commit as creators of releases."""
+
+GITLAB_CONTRIBUTORS_MAX = 100
+"""Maximum number of contributors resolved for a release."""
+
+GITLAB_CONTRIBUTORS_REF = True
+"""Restrict the contributors API of GitLab to the released commit.
+
+Set it to ``False`` for GitLab versions whose contributors API has no ``ref``
+parameter and always counts the commits of the default branch.
+"""
+
+GITLAB_CONTRIBUTORS_CACHE_TTL = timedelta(days=30)
+"""Time period for which the contributors of a commit are cached.
+
+Contributors of a release are resolved incrementally from the contributors
+of the previous release while these are cached.
+"""
+
+GITLAB_PREFETCH_WORKERS = 4
+"""Maximum number of concurrent GitLab requests when publishing a release."""
+
+GITLAB_RELEASE_QUEUES = None
+"""Celery queues processing releases, by repository size.
+
+A list of dicts ordered by size, e.g.::
+
+    GITLAB_RELEASE_QUEUES = [
+        dict(queue='gitlab-small', max_size=100 * 1024 * 1024,
+             time_limit=15 * 60),
+        dict(queue='gitlab-large', time_limit=3 * 60 * 60),
+    ]
+
+A release is sent to the first queue whose ``max_size`` in bytes is at least
+the repository size in the project statistics. The last queue takes larger
+repositories and those of unknown size. All other keys are passed to
+``apply_async``, e.g. ``time_limit`` and ``soft_time_limit``. The concurrency
+of a queue is that of the workers consuming it, e.g.
+``celery worker -Q gitlab-large --concurrency 2``.
+
+The stages of ``GITLAB_RELEASE_PIPELINE`` are routed the same way. Batches
+dispatched by ``drain_releases`` run in the default queue.
+
+By default all releases are sent to the default queue.
+"""
+
+GITLAB_REPOSITORY_SIZE_CACHE_TTL = timedelta(hours=6)
+"""Time period for which the repository size of a project is cached."""
+
+GITLAB_RELEASE_PROJECT_CONCURRENCY = None
+"""Maximum number of releases of a project processed at once.
+
+Releases over the limit are deferred by ``GITLAB_RELEASE_DEFER_COUNTDOWN``.
+``None`` disables the limit.
+"""
+
+GITLAB_RELEASE_USER_CONCURRENCY = None
+"""Maximum number of releases of a user processed at once.
+
+Releases over the limit are deferred by ``GITLAB_RELEASE_DEFER_COUNTDOWN``.
+``None`` disables the limit.
+"""
+
+GITLAB_RELEASE_DEFER_COUNTDOWN = timedelta(seconds=30)
+"""Minimum delay of releases over the concurrency limits, at most doubled."""
+
+GITLAB_RELEASE_LEASE_TTL = timedelta(hours=3)
+"""Time period after which the concurrency slot of a release is freed.
+
+It must exceed the processing time of the largest release, as slots of
+crashed workers are only freed once their lease expires.
+"""
+
+GITLAB_RELEASE_CLAIM_TTL = timedelta(hours=6)
+"""Time period after which a release still processing can be claimed again.
+
+It must exceed the processing time of the largest release, as the release
+is otherwise processed twice. ``None`` disables the recovery of releases
+claimed by crashed workers.
+"""
+
+GITLAB_RELEASE_BATCH_SIZE = 50
+"""Maximum number of releases claimed by one batch task."""
+
+GITLAB_RELEASE_BATCH_WORKERS = 4
+"""Number of releases of a batch processed concurrently."""
+
+GITLAB_RELEASE_DRAIN_THRESHOLD = 100
+"""Number of received releases above which batch tasks are dispatched."""
+
+GITLAB_RELEASE_DRAIN_MAX_BATCHES = 10
+"""Maximum number of batch tasks dispatched at once by the drainer."""
+
+GITLAB_RELEASE_PIPELINE = False
+"""Publish releases with a chain of tasks, one per stage.
+
+The stages resolve the metadata, store the archive, build the deposit,
+publish it and finalise the release. Each stage saves its results on the
+release and is retried on its own, so e.g. an indexing error does not
+download the archive again.
+"""
+
+GITLAB_RELEASE_STAGE_MAX_RETRIES = 5
+"""Number of retries of a failed stage of the publish pipeline."""
+
+GITLAB_RELEASE_STAGE_RETRY_DELAY = timedelta(seconds=30)
+"""Delay before the first retry of a stage, doubled for each further retry."""
+
+GITLAB_ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar.gz': 'application/gzip',
+    'tar.bz2': 'application/x-bzip2',
+    'tar': 'application/x-tar',
+}
+"""Repository archive formats offered by GitLab and their MIME types."""
+
+GITLAB_ARCHIVE_FORMAT = 'zip'
+"""Default format of the repository archives of releases.
+
+Projects can override it. Uncompressed ``tar`` archives save CPU time on
+GitLab and on the workers, if the files storage compresses server-side.
+"""
+
+GITLAB_ARCHIVE_CHUNK_SIZE = 1024 * 1024
+"""Size in bytes of the chunks in which repository archives are downloaded.
+
+Archives are streamed into the files storage, so memory usage during a
+release only depends on this value and the storage chunk size.
+"""
+
+GITLAB_ARCHIVE_DEDUPLICATION = True
+"""Reuse the stored archive of a commit for all releases of that commit."""
+
+GITLAB_ARCHIVE_SPOOL = False
+"""Download repository archives to disk before storing them.
+
+Interrupted downloads are resumed with HTTP range requests, and the archive
+is only stored once it is complete. Archives of failed releases are kept in
+the spool directory, so retrying the release resumes the download.
+"""
+
+GITLAB_ARCHIVE_SPOOL_DIR = None
+"""Directory for spooled archives. Defaults to the temporary directory."""
+
+GITLAB_ARCHIVE_SPOOL_MAX_AGE = timedelta(days=7)
+"""Time period after which spooled archives of failed releases are deleted.
+
+The spool directory is swept by the ``prune_release_archives`` task.
+"""
+
+GITLAB_ARCHIVE_MAX_RETRIES = 5
+"""Number of times an interrupted archive download is resumed."""
+
+GITLAB_DISCONNECT_WORKERS = 8
+"""Number of webhooks deleted concurrently when an account is disconnected."""
+
+GITLAB_DISCONNECT_CHUNK_SIZE = 100
+"""Number of webhooks deleted per chunk when an account is disconnected."""
+
 GITLAB_SHARED_SECRET = 'CHANGEME'
 """Shared secret between the application and GitLab."""
 
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Contributors of released commits."""
+
+from __future__ import absolute_import
+
+from gitlab import GitlabError
+
+
+class ContributorResolver(object):
+    """Resolve the contributors of a project at a commit.
+
+    Contributors are cached per project and commit. If the contributors of
+    the previous release are cached, only the commits since then are fetched
+    with the compare API. Otherwise the contributors API is asked for the
+    top contributors by number of commits, which covers the default branch.
+
+    Only the ``max_contributors`` contributors with the most commits are
+    kept, so incremental results are approximate for contributors close to
+    the cap.
+
+    The contributors API is restricted to the released commit with its
+    ``ref`` parameter. GitLab versions without it count the commits of the
+    default branch instead. With ``ref=False`` such counts are only used as
+    the base of incremental results if the released commit is the head of
+    the default branch.
+
+    :param project: Handle of the GitLab project.
+    :param cache: Cache backend, see :mod:`invenio_gitlab.cache`.
+    :param int max_contributors: Maximum number of resolved contributors.
+    :param float ttl: Seconds for which contributors are cached.
+    :param bool ref: Whether GitLab supports the ``ref`` parameter of the
+        contributors API.
+    """
+
+    def __init__(self, project, cache, max_contributors=100, ttl=None, ref=True):
+        """Initialize the resolver."""
+        self.project = project
+        self.cache = cache
+        self.max_contributors = max_contributors
+        self.ttl = ttl
+        self.ref = ref
+
+    def cache_key(self, sha, exact=True):
+        """Return the cache key of the contributors at a commit.
+
+        Contributors counted on another ref than ``sha`` are cached under a
+        separate key, so they are never the base of incremental results.
+        """
+        prefix = "contributors" if exact else "contributors-approx"
+        return "{0}:{1}:{2}".format(prefix, self.project.id, sha)
+
+    @staticmethod
+    def _key(name, email):
+        return (email or name or "").lower()
+
+    def _fetch_all(self, sha):
+        """Return the top contributors of the project at a commit."""
+        params = {}
+        if self.ref:
+            params["ref"] = sha
+        contributors = self.project.repository_contributors(
+            order_by="commits",
+            sort="desc",
+            iterator=True,
+            per_page=min(self.max_contributors, 100),
+            **params
+        )
+        result = []
+        for contributor in contributors:
+            result.append(
+                dict(
+                    name=contributor["name"],
+                    email=contributor["email"],
+                    commits=contributor["commits"],
+                )
+            )
+            if len(result) >= self.max_contributors:
+                break
+        return result
+
+    def _is_default_head(self, sha):
+        """Return True, if a commit is the head of the default branch."""
+        try:
+            project = self.project.manager.get(self.project.id)
+            branch = project.branches.get(project.default_branch)
+        except GitlabError:
+            return False
+        return branch.commit["id"] == sha
+
+    def _fetch_since(self, previous, previous_sha, sha):
+        """Add the authors of the commits since ``previous_sha``."""
+        contributors = {self._key(c["name"], c["email"]): dict(c) for c in previous}
+        compare = self.project.repository_compare(previous_sha, sha)
+        for commit in compare["commits"]:
+            key = self._key(commit["author_name"], commit["author_email"])
+            contributor = contributors.setdefault(
+                key,
+                dict(
+                    name=commit["author_name"],
+                    email=commit["author_email"],
+                    commits=0,
+                ),
+            )
+            contributor["commits"] += 1
+        result = sorted(contributors.values(), key=lambda c: -c["commits"])
+        return result[: self.max_contributors]
+
+    def resolve(self, sha, previous_sha=None):
+        """Return the contributors at a commit, most active first.
+
+        :param str sha: Commit SHA of the release.
+        :param str previous_sha: Commit SHA of the previous release.
+        :returns: List of dicts with ``name``, ``email`` and ``commits``.
+        """
+        for exact in (True, False):
+            contributors = self.cache.get(self.cache_key(sha, exact=exact))
+            if contributors is not None:
+                return contributors
+
+        previous = None
+        if previous_sha and previous_sha != sha:
+            previous = self.cache.get(self.cache_key(previous_sha))
+        if previous is not None:
+            contributors = self._fetch_since(previous, previous_sha, sha)
+            exact = True
+        else:
+            contributors = self._fetch_all(sha)
+            exact = self.ref or self._is_default_head(sha)
+        self.cache.set(self.cache_key(sha, exact=exact), contributors, ttl=self.ttl)
+        return contributors
@@ -46,3 +46,30 @@ class CustomGitLabMetadataError(GitLabError):
 
 class NoVersionTagError(GitLabError):
     """The version tag does not match the configured pattern."""
+
+
+class ReleaseArchiveError(GitLabError):
+    """The stored repository archive differs from the downloaded one."""
+
+
+class ReleasePrefetchError(GitLabError):
+    """Fetching the inputs of a release from GitLab failed.
+
+    :param dict errors: Exceptions keyed by the name of the failed input.
+    """
+
+    def __init__(self, errors):
+        """Initialize the error."""
+        self.errors = errors
+        super(ReleasePrefetchError, self).__init__(
+            "Fetching the release from GitLab failed: {0}".format(
+                "; ".join(
+                    "{0}: {1}".format(name, error)
+                    for name, error in sorted(errors.items())
+                )
+            )
+        )
+
+
+class ReleaseStageError(GitLabError):
+    """A stage of the publish pipeline ran out of order."""
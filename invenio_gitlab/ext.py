@@ -31,6 +31,8 @@ from werkzeug.utils import cached_property, import_string
 
 from . import config
 from .api import GitLabRelease
+from .client import GitLabClientPool
+from .ratelimit import RateLimiter
 
 
 class InvenioGitLab(object):
@@ -58,6 +60,52 @@ class InvenioGitLab(object):
             return import_string(imp)
         return imp
 
+    @cached_property
+    def client_pool(self):
+        """Process-wide pool of GitLab API clients."""
+        ttl = current_app.config["GITLAB_CLIENT_POOL_TTL"]
+        user_ttl = current_app.config["GITLAB_USER_CACHE_TTL"]
+        session_options = dict(rate_limiter=self.rate_limiter)
+        if current_app.config["GITLAB_HTTP_CACHE"]:
+            cache_ttl = current_app.config["GITLAB_HTTP_CACHE_TTL"]
+            session_options.update(
+                cache=self.cache,
+                ttl=cache_ttl.total_seconds() if cache_ttl else None,
+                max_item_size=current_app.config["GITLAB_HTTP_CACHE_MAX_ITEM_SIZE"],
+            )
+        return GitLabClientPool(
+            maxsize=current_app.config["GITLAB_CLIENT_POOL_SIZE"],
+            ttl=ttl.total_seconds() if ttl else None,
+            connections=current_app.config["GITLAB_HTTP_POOL_CONNECTIONS"],
+            lazy_auth=current_app.config["GITLAB_LAZY_AUTH"],
+            user_ttl=user_ttl.total_seconds() if user_ttl else None,
+            session_options=session_options,
+        )
+
+    @cached_property
+    def rate_limiter(self):
+        """Rate limiter shared by all GitLab clients, if enabled."""
+        limit = current_app.config["GITLAB_RATE_LIMIT"]
+        if not limit:
+            return None
+        count, period = limit
+        backend = current_app.config["GITLAB_RATE_LIMIT_BACKEND"]
+        if isinstance(backend, string_types):
+            backend = import_string(backend)
+        return RateLimiter(
+            backend(),
+            rate=count / period.total_seconds(),
+            burst=current_app.config["GITLAB_RATE_LIMIT_BURST"],
+        )
+
+    @cached_property
+    def cache(self):
+        """Cache backend shared by the GitLab integration."""
+        cls = current_app.config["GITLAB_CACHE_BACKEND"]
+        if isinstance(cls, string_types):
+            cls = import_string(cls)
+        return cls()
+
     def init_app(self, app):
         """Flask application initialization."""
         self.init_config(app)
@@ -21,7 +21,6 @@
 
 from __future__ import absolute_import
 
-import gitlab
 from flask import current_app, redirect, url_for
 from flask_login import current_user
 from invenio_db import db
@@ -31,7 +30,8 @@ from invenio_oauthclient.models import RemoteToken
 from sqlalchemy.orm.exc import NoResultFound
 
 from .api import GitLabAPI
-from .models import Project
+from .models import AccountProject, Project
+from .proxies import current_gitlab
 from .tasks import disconnect_gitlab
 
 REMOTE_APP = dict(
@@ -71,12 +71,10 @@ def account_setup(remote, token=None, response=None, account_setup=None):
 
 def account_info(remote, resp):
     """Retrieve remote account information used to find local user."""
-    gl = gitlab.Gitlab(
-        current_app.config["GITLAB_BASE_URL"],
-        oauth_token=resp["access_token"],
+    gluser = current_gitlab.client_pool.user(
+        current_app.config["GITLAB_BASE_URL"], resp["access_token"]
     )
-    gl.auth()
-    user_attrs = gl.user.attributes
+    user_attrs = gluser.attributes
     return dict(
         user=dict(
             email=user_attrs["email"],
@@ -131,6 +129,8 @@ def disconnect_handler(remote):
         disconnect_gitlab.delay(token.access_token, projects_with_hooks)
 
         # Delete the RemoteAccount (along with the associated RemoteToken)
+        # and its cached projects.
+        AccountProject.query.filter_by(account_id=token.remote_account.id).delete()
         token.remote_account.delete()
 
     return redirect(url_for("invenio_oauthclient_settings.index"))
@@ -23,12 +23,16 @@ from __future__ import absolute_import
 
 import fnmatch
 import uuid
+from datetime import datetime
 from enum import Enum
 
+import sqlalchemy as sa
 from flask import current_app
 from invenio_accounts.models import User
 from invenio_db import db
+from invenio_files_rest.models import FileInstance, ObjectVersion
 from invenio_i18n import lazy_gettext as _
+from invenio_oauthclient.models import RemoteAccount
 from invenio_records.api import Record
 from invenio_records.models import RecordMetadata
 from invenio_webhooks.models import Event
@@ -154,6 +158,9 @@ class Project(db.Model, Timestamp):
     )
     """Pattern to compare release tags with."""
 
+    archive_format = db.Column(db.String(16), nullable=True)
+    """Format of the repository archives, if not ``GITLAB_ARCHIVE_FORMAT``."""
+
     # Relationships
     user = db.relationship(User)
 
@@ -204,6 +211,55 @@ class Project(db.Model, Timestamp):
             )
         return project
 
+    @classmethod
+    def rename(cls, user_id, names):
+        """Update the names of a user's projects in a single statement.
+
+        Only rows whose name actually changed are touched. On PostgreSQL the
+        new names are joined as ``UPDATE ... FROM (VALUES ...)``, other
+        databases use a ``CASE`` expression.
+
+        :param int user_id: User identifier.
+        :param dict names: New full names keyed by GitLab project identifier.
+        :returns: Number of renamed projects.
+        """
+        if not names:
+            return 0
+        if db.session.get_bind().dialect.name == "postgresql":
+            new_names = sa.values(
+                sa.column("gitlab_id", db.Integer),
+                sa.column("name", db.String),
+                name="new_names",
+            ).data(list(names.items()))
+            new_name = new_names.c.name
+            where = cls.gitlab_id == new_names.c.gitlab_id
+        else:
+            new_name = sa.case(names, value=cls.gitlab_id)
+            where = cls.gitlab_id.in_(names.keys())
+        stmt = (
+            sa.update(cls)
+            .where(where, cls.user_id == user_id, cls.name != new_name)
+            .values(name=new_name, updated=datetime.utcnow())
+        )
+        result = db.session.execute(
+            stmt, execution_options=dict(synchronize_session=False)
+        )
+        return result.rowcount
+
+    @classmethod
+    def disown(cls, user_id, account_id, seen_at):
+        """Remove a user's ownership of projects not seen by a sync.
+
+        :param int user_id: User identifier.
+        :param int account_id: Remote account identifier of the user.
+        :param datetime seen_at: Start of the sync.
+        :returns: Number of disowned projects.
+        """
+        return cls.query.filter(
+            cls.user_id == user_id,
+            cls.gitlab_id.notin_(AccountProject.seen_since(account_id, seen_at)),
+        ).update(dict(user_id=None, hook=None), synchronize_session=False)
+
     @classmethod
     def enable(cls, user_id, gitlab_id, name, hook):
         """Enable webhooks for a project."""
@@ -241,6 +297,123 @@ class Project(db.Model, Timestamp):
         return "<Project {self.name}:{self.gitlab_id}>".format(self=self)
 
 
+class AccountProject(db.Model):
+    """GitLab project owned by a connected account.
+
+    This is the cached result of the last project sync of a
+    :class:`~invenio_oauthclient.models.RemoteAccount`. It lists all owned
+    projects, whether or not webhooks are enabled for them.
+    """
+
+    __tablename__ = "gitlab_account_projects"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    """Row identifier."""
+
+    account_id = db.Column(
+        db.Integer,
+        db.ForeignKey(RemoteAccount.id, ondelete="CASCADE"),
+        nullable=False,
+    )
+    """Remote account owning the project."""
+
+    gitlab_id = db.Column(db.Integer, nullable=False)
+    """Unique identifier for a GitLab project."""
+
+    full_name = db.Column(db.String(255), nullable=False)
+    """Fully qualified name of the project including user/organization."""
+
+    description = db.Column(db.Text, nullable=True)
+    """Project description."""
+
+    synced_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    """Last time the project has been changed by a sync."""
+
+    seen_at = db.Column(db.DateTime, nullable=True)
+    """Start of the last sync which listed the project."""
+
+    __table_args__ = (
+        db.UniqueConstraint("account_id", "gitlab_id"),
+        db.Index("ix_gitlab_account_projects_full_name", "account_id", "full_name"),
+    )
+
+    @classmethod
+    def update_projects(cls, account_id, projects, seen_at=None):
+        """Insert or update cached projects of an account.
+
+        Only projects whose name or description changed are written, but all
+        of them are stamped with ``seen_at`` in a single statement.
+
+        :param int account_id: Remote account identifier.
+        :param dict projects: ``full_name`` and ``description`` keyed by GitLab
+            project identifier.
+        :param datetime seen_at: Start of the current sync.
+        """
+        if not projects:
+            return
+        existing = {
+            obj.gitlab_id: obj
+            for obj in cls.query.filter(
+                cls.account_id == account_id,
+                cls.gitlab_id.in_(projects.keys()),
+            )
+        }
+        now = datetime.utcnow()
+        seen_at = seen_at or now
+        if existing:
+            cls.query.filter(
+                cls.account_id == account_id,
+                cls.gitlab_id.in_(existing.keys()),
+            ).update(dict(seen_at=seen_at), synchronize_session=False)
+        for gitlab_id, attrs in projects.items():
+            obj = existing.get(gitlab_id)
+            if obj is None:
+                db.session.add(
+                    cls(
+                        account_id=account_id,
+                        gitlab_id=gitlab_id,
+                        synced_at=now,
+                        seen_at=seen_at,
+                        **attrs,
+                    )
+                )
+            elif (obj.full_name, obj.description) != (
+                attrs["full_name"],
+                attrs["description"],
+            ):
+                obj.full_name = attrs["full_name"]
+                obj.description = attrs["description"]
+                obj.synced_at = now
+
+    @classmethod
+    def seen_since(cls, account_id, seen_at):
+        """Select the GitLab identifiers of projects seen by a sync.
+
+        :param int account_id: Remote account identifier.
+        :param datetime seen_at: Start of the sync.
+        """
+        return sa.select(cls.gitlab_id).where(
+            cls.account_id == account_id, cls.seen_at >= seen_at
+        )
+
+    @classmethod
+    def prune(cls, account_id, seen_at):
+        """Remove cached projects of an account not seen by a sync.
+
+        :param int account_id: Remote account identifier.
+        :param datetime seen_at: Start of the sync.
+        :returns: Number of removed projects.
+        """
+        return cls.query.filter(
+            cls.account_id == account_id,
+            sa.or_(cls.seen_at.is_(None), cls.seen_at < seen_at),
+        ).delete(synchronize_session=False)
+
+    def __repr__(self):
+        """Get account project representation."""
+        return "<AccountProject {self.full_name}:{self.gitlab_id}>".format(self=self)
+
+
 class Release(db.Model, Timestamp):
     """Information about a GitLab version tag."""
 
@@ -287,6 +460,24 @@ class Release(db.Model, Timestamp):
     )
     """Status of the release, e.g. 'processing', 'published', 'failed', etc."""
 
+    stage = db.Column(db.String(32), nullable=True)
+    """Last completed stage of the publish pipeline."""
+
+    stage_data = db.Column(
+        db.JSON()
+        .with_variant(
+            postgresql.JSON(none_as_null=True),
+            "postgresql",
+        )
+        .with_variant(JSONType(), "sqlite")
+        .with_variant(JSONType(), "mysql"),
+        nullable=True,
+    )
+    """Results of the completed stages of the publish pipeline."""
+
+    claim_token = db.Column(db.String(255), nullable=True)
+    """Token of the task processing the release, see :meth:`claim`."""
+
     project = db.relationship(Project, backref=db.backref("releases", lazy="dynamic"))
 
     recordmetadata = db.relationship(RecordMetadata, backref="gitlab_releases")
@@ -337,6 +528,115 @@ class Release(db.Model, Timestamp):
                 "{project} is not enabled for webhooks.".format(project=project)
             )
 
+    @classmethod
+    def _claim(cls, criteria, token, limit=None):
+        """Claim the releases matching ``criteria`` for a task.
+
+        On PostgreSQL the releases are locked with ``FOR UPDATE SKIP
+        LOCKED``, so concurrent tasks claim different releases without
+        waiting. Other databases use a compare-and-set ``UPDATE`` of the
+        status.
+        """
+        query = cls.query.filter(*criteria).order_by(cls.created)
+        if limit is not None:
+            query = query.limit(limit)
+        if db.session.get_bind().dialect.name == "postgresql":
+            releases = query.with_for_update(skip_locked=True).all()
+            for release in releases:
+                release.status = ReleaseStatus.PROCESSING
+                release.claim_token = token
+            return releases
+
+        ids = [release_id for (release_id,) in query.with_entities(cls.id)]
+        if not ids:
+            return []
+        stmt = (
+            sa.update(cls)
+            .where(cls.id.in_(ids), *criteria)
+            .values(
+                status=ReleaseStatus.PROCESSING,
+                claim_token=token,
+                updated=datetime.utcnow(),
+            )
+        )
+        db.session.execute(stmt, execution_options=dict(synchronize_session=False))
+        return (
+            cls.query.filter(
+                cls.id.in_(ids),
+                cls.status == ReleaseStatus.PROCESSING,
+                cls.claim_token == token,
+            )
+            .order_by(cls.created)
+            .populate_existing()
+            .all()
+        )
+
+    @classmethod
+    def claimable(cls, token=None, statuses=(ReleaseStatus.RECEIVED,)):
+        """Build the criterion of the releases a task can claim.
+
+        Besides releases in one of ``statuses``, this matches releases
+        already claimed with ``token``, e.g. by a redelivered task, and
+        releases whose claim is older than ``GITLAB_RELEASE_CLAIM_TTL``,
+        e.g. of a crashed worker.
+
+        :param str token: Idempotency token of the task, e.g. its task id.
+        :param statuses: Claimable release statuses.
+        """
+        criteria = [cls.status.in_(statuses)]
+        if token is not None:
+            criteria.append(
+                sa.and_(
+                    cls.status == ReleaseStatus.PROCESSING,
+                    cls.claim_token == token,
+                )
+            )
+        ttl = current_app.config.get("GITLAB_RELEASE_CLAIM_TTL")
+        if ttl is not None:
+            criteria.append(
+                sa.and_(
+                    cls.status == ReleaseStatus.PROCESSING,
+                    cls.updated < datetime.utcnow() - ttl,
+                )
+            )
+        return sa.or_(*criteria)
+
+    @classmethod
+    def claim(cls, tag, project_id, token):
+        """Mark a release as processed by a task, unless another task does.
+
+        Received and failed releases can be claimed, as well as releases
+        already claimed with the same token, e.g. by a redelivered task,
+        and stale claims (see :meth:`claimable`).
+
+        :param str tag: Release tag.
+        :param project_id: Project identifier.
+        :param str token: Idempotency token of the task, e.g. its task id.
+        :returns: The claimed release, or ``None``.
+        """
+        releases = cls._claim(
+            (
+                cls.tag == tag,
+                cls.project_id == project_id,
+                cls.claimable(token, (ReleaseStatus.RECEIVED, ReleaseStatus.FAILED)),
+            ),
+            token,
+        )
+        return releases[0] if releases else None
+
+    @classmethod
+    def claim_received(cls, token, limit):
+        """Claim the oldest received releases for a task.
+
+        A redelivered task resumes the releases it claimed before, and
+        stale claims are taken over (see :meth:`claimable`).
+
+        :param str token: Idempotency token of the task, e.g. its task id.
+        :param int limit: Maximum number of claimed releases.
+        :returns: List of the claimed releases.
+        """
+        return cls._claim((cls.claimable(token),), token, limit=limit)
+
     @property
     def record(self):
         """Get record object."""
@@ -356,3 +656,192 @@ class Release(db.Model, Timestamp):
     def __repr__(self):
         """Get release representation."""
         return "<Release {self.tag} ({self.status.title})>".format(self=self)
+
+
+class ReleaseArchive(db.Model, Timestamp):
+    """Stored repository archive of a project commit.
+
+    Releases of the same commit, e.g. tags ``v1.0`` and ``v1.0.0``, share the
+    stored archive instead of downloading and storing it again. The objects
+    referencing a file instance are its reference count: an archive is only
+    reused while at least one object version points to it, so files
+    removed by Invenio-Files-REST are never resurrected.
+    """
+
+    __tablename__ = "gitlab_release_archives"
+
+    project_id = db.Column(
+        UUIDType,
+        db.ForeignKey(Project.id, ondelete="CASCADE"),
+        primary_key=True,
+    )
+    """Project identifier."""
+
+    commit_sha = db.Column(db.String(40), primary_key=True)
+    """Commit of the archive."""
+
+    archive_format = db.Column(db.String(16), primary_key=True)
+    """Format of the archive, e.g. ``zip``."""
+
+    file_id = db.Column(
+        UUIDType,
+        db.ForeignKey(FileInstance.id, ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    """Stored file of the archive."""
+
+    file = db.relationship(FileInstance)
+
+    @classmethod
+    def _referenced(cls):
+        return sa.exists().where(ObjectVersion.file_id == cls.file_id)
+
+    @classmethod
+    def get(cls, project_id, commit_sha, archive_format):
+        """Return the stored file of an archive, or ``None``.
+
+        :param project_id: Project identifier.
+        :param str commit_sha: Commit of the archive.
+        :param str archive_format: Format of the archive.
+        """
+        obj = (
+            cls.query.join(FileInstance)
+            .filter(
+                cls.project_id == project_id,
+                cls.commit_sha == commit_sha,
+                cls.archive_format == archive_format,
+                FileInstance.readable.is_(True),
+                cls._referenced(),
+            )
+            .one_or_none()
+        )
+        return obj.file if obj else None
+
+    @classmethod
+    def create(cls, project_id, commit_sha, archive_format, file_id):
+        """Index a stored archive.
+
+        An entry of an archive that is no longer used is replaced, while an
+        archive indexed in the meantime by a concurrent release of the same
+        commit is kept.
+        """
+        try:
+            with db.session.begin_nested():
+                cls.query.filter(
+                    cls.project_id == project_id,
+                    cls.commit_sha == commit_sha,
+                    cls.archive_format == archive_format,
+                    ~cls._referenced(),
+                ).delete(synchronize_session=False)
+                db.session.add(
+                    cls(
+                        project_id=project_id,
+                        commit_sha=commit_sha,
+                        archive_format=archive_format,
+                        file_id=file_id,
+                    )
+                )
+        except (sa.exc.IntegrityError, sa.orm.exc.FlushError):
+            pass
+
+    @property
+    def references(self):
+        """Return the number of object versions using the archive."""
+        return ObjectVersion.query.filter_by(file_id=self.file_id).count()
+
+    @classmethod
+    def prune(cls):
+        """Remove index entries of archives no object version uses anymore.
+
+        :returns: Number of removed entries.
+        """
+        return cls.query.filter(~cls._referenced()).delete(synchronize_session=False)
+
+    def __repr__(self):
+        """Get release archive representation."""
+        return "<ReleaseArchive {self.commit_sha}.{self.archive_format}>".format(
+            self=self
+        )
+
+
+class ReleaseLease(db.Model):
+    """Lease of a slot for processing releases.
+
+    A scope, e.g. a project or a user, has as many slots as releases of it
+    may be processed at once. A task holds at most one slot per scope, and
+    slots whose lease has expired, e.g. after a worker crashed, are taken
+    over by other tasks.
+    """
+
+    __tablename__ = "gitlab_release_leases"
+
+    scope = db.Column(db.String(255), primary_key=True)
+    """Scope of the slot, e.g. ``project:<id>``."""
+
+    slot = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    """Number of the slot within the scope."""
+
+    token = db.Column(db.String(255), nullable=False, index=True)
+    """Token of the task holding the slot."""
+
+    expires_at = db.Column(db.DateTime, nullable=False)
+    """Time after which the slot may be taken over."""
+
+    @classmethod
+    def acquire(cls, scope, limit, token, ttl):
+        """Take a free slot of a scope, or renew the slot held by a task.
+
+        :param str scope: Scope of the slots.
+        :param int limit: Number of slots of the scope.
+        :param str token: Token of the task, e.g. its task id.
+        :param ttl: :class:`~datetime.timedelta` until the lease expires.
+        :returns: ``True`` if the task holds a slot.
+        """
+        now = datetime.utcnow()
+        renew = (
+            sa.update(cls)
+            .where(cls.scope == scope, cls.token == token)
+            .values(expires_at=now + ttl)
+        )
+        if db.session.execute(renew).rowcount:
+            return True
+        for slot in range(limit):
+            take_over = (
+                sa.update(cls)
+                .where(cls.scope == scope, cls.slot == slot, cls.expires_at < now)
+                .values(token=token, expires_at=now + ttl)
+            )
+            if db.session.execute(take_over).rowcount:
+                return True
+            try:
+                with db.session.begin_nested():
+                    db.session.add(
+                        cls(scope=scope, slot=slot, token=token, expires_at=now + ttl)
+                    )
+                return True
+            except sa.exc.IntegrityError:
+                continue
+        return False
+
+    @classmethod
+    def acquire_all(cls, limits, token, ttl):
+        """Take a slot of each scope, or none at all.
+
+        :param dict limits: Number of slots keyed by scope.
+        :returns: ``True`` if the task holds a slot of every scope.
+        """
+        for scope, limit in sorted(limits.items()):
+            if not cls.acquire(scope, limit, token, ttl):
+                cls.release(token)
+                return False
+        return True
+
+    @classmethod
+    def release(cls, token):
+        """Free all slots held by a task."""
+        cls.query.filter(cls.token == token).delete(synchronize_session=False)
+
+    def __repr__(self):
+        """Get release lease representation."""
+        return "<ReleaseLease {self.scope}#{self.slot}>".format(self=self)
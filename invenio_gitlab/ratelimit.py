@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Throttling of GitLab API requests.
+
+All processes talking to GitLab with the same token share one token bucket.
+The bucket refills at the configured rate and is corrected with the
+``RateLimit-Remaining`` and ``RateLimit-Reset`` headers sent by GitLab, so
+callers slow down before GitLab starts rejecting requests.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+from flask import current_app
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryRateLimitBackend(object):
+    """Token buckets local to the current process.
+
+    :param int maxsize: Maximum number of buckets kept. The least recently
+        used buckets are dropped first, which refills them.
+    """
+
+    def __init__(self, maxsize=10000):
+        """Initialize the backend."""
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def _refill(self, key, rate, burst, now):
+        tokens, stamp, blocked = self._buckets.get(key, (burst, now, 0))
+        tokens = min(burst, tokens + max(now - stamp, 0) * rate)
+        return tokens, blocked
+
+    def acquire(self, key, rate, burst, now):
+        """Take a token and return 0, or return the seconds to wait."""
+        with self._lock:
+            tokens, blocked = self._refill(key, rate, burst, now)
+            if now < blocked:
+                wait = blocked - now
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets.set(key, (tokens, now, blocked))
+            return wait
+
+    def update(self, key, rate, burst, now, remaining=None, blocked=0):
+        """Correct a bucket with the limits reported by GitLab."""
+        with self._lock:
+            tokens, old_blocked = self._refill(key, rate, burst, now)
+            if remaining is not None:
+                tokens = min(tokens, remaining)
+            self._buckets.set(key, (tokens, now, max(blocked, old_blocked)))
+
+
+class RedisRateLimitBackend(object):
+    """Token buckets shared by all processes through Redis.
+
+    :param str url: Redis URL. Defaults to ``GITLAB_CACHE_REDIS_URL``, or
+        ``CACHE_REDIS_URL`` if the former is not set.
+    :param str prefix: Prefix of all keys stored by this backend.
+    """
+
+    ACQUIRE = """
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp', 'blocked')
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]),
+            tonumber(ARGV[3])
+        local tokens = tonumber(state[1]) or burst
+        local stamp = tonumber(state[2]) or now
+        local blocked = tonumber(state[3]) or 0
+        tokens = math.min(burst, tokens + math.max(now - stamp, 0) * rate)
+        local wait = 0
+        if now < blocked then
+            wait = blocked - now
+        elseif tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now,
+            'blocked', blocked)
+        redis.call('EXPIRE', KEYS[1], ARGV[4])
+        return tostring(wait)
+    """
+
+    UPDATE = """
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp', 'blocked')
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]),
+            tonumber(ARGV[3])
+        local tokens = tonumber(state[1]) or burst
+        local stamp = tonumber(state[2]) or now
+        local blocked = math.max(tonumber(state[3]) or 0, tonumber(ARGV[5]))
+        tokens = math.min(burst, tokens + math.max(now - stamp, 0) * rate)
+        if ARGV[4] ~= '' then
+            tokens = math.min(tokens, tonumber(ARGV[4]))
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now,
+            'blocked', blocked)
+        redis.call('EXPIRE', KEYS[1], ARGV[6])
+    """
+
+    def __init__(self, url=None, prefix="invenio_gitlab:ratelimit:"):
+        """Initialize the backend."""
+        import redis
+
+        url = (
+            url
+            or current_app.config.get("GITLAB_CACHE_REDIS_URL")
+            or current_app.config["CACHE_REDIS_URL"]
+        )
+        self.prefix = prefix
+        self._redis = redis.StrictRedis.from_url(url)
+        self._acquire = self._redis.register_script(self.ACQUIRE)
+        self._update = self._redis.register_script(self.UPDATE)
+
+    @staticmethod
+    def _expiry(rate, burst):
+        # Keep a bucket until it would be full again anyway.
+        return int(burst / rate) + 60
+
+    def acquire(self, key, rate, burst, now):
+        """Take a token and return 0, or return the seconds to wait."""
+        return float(
+            self._acquire(
+                keys=[self.prefix + key],
+                args=[rate, burst, now, self._expiry(rate, burst)],
+            )
+        )
+
+    def update(self, key, rate, burst, now, remaining=None, blocked=0):
+        """Correct a bucket with the limits reported by GitLab."""
+        self._update(
+            keys=[self.prefix + key],
+            args=[
+                rate,
+                burst,
+                now,
+                "" if remaining is None else remaining,
+                blocked,
+                self._expiry(rate, burst),
+            ],
+        )
+
+
+class RateLimiter(object):
+    """Token bucket throttling the requests made with one GitLab token.
+
+    :param backend: Storage of the buckets, see :class:`MemoryRateLimitBackend`
+        and :class:`RedisRateLimitBackend`.
+    :param float rate: Requests per second granted to each token.
+    :param int burst: Requests which may be sent at once after idling.
+    :param timer: Wall clock shared by all processes, replaceable for testing.
+    :param sleep: Function used to wait, replaceable for testing.
+    """
+
+    def __init__(self, backend, rate, burst, timer=time.time, sleep=time.sleep):
+        """Initialize the rate limiter."""
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.timer = timer
+        self.sleep = sleep
+
+    def acquire(self, key):
+        """Block until a request may be sent with the given key."""
+        while True:
+            wait = self.backend.acquire(key, self.rate, self.burst, self.timer())
+            if wait <= 0:
+                return
+            self.sleep(wait)
+
+    def update(self, key, response):
+        """Apply the rate limit headers of a GitLab response."""
+        headers = response.headers
+        now = self.timer()
+        remaining = blocked = None
+        try:
+            if "RateLimit-Remaining" in headers:
+                remaining = int(headers["RateLimit-Remaining"])
+            if remaining is not None and remaining <= 0:
+                blocked = float(headers["RateLimit-Reset"])
+            if response.status_code == 429:
+                blocked = max(blocked or 0, now + float(headers.get("Retry-After", 1)))
+        except (KeyError, ValueError):
+            logger.warning("Invalid rate limit headers from GitLab: %s", dict(headers))
+        if remaining is not None or blocked is not None:
+            self.backend.update(
+                key,
+                self.rate,
+                self.burst,
+                now,
+                remaining=remaining,
+                blocked=blocked or 0,
+            )
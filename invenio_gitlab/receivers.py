@@ -24,10 +24,12 @@ from __future__ import absolute_import
 from invenio_db import db
 from invenio_webhooks.models import Receiver
 
+from .api import GitLabAPI
 from .errors import NoVersionTagError, ProjectAccessError, \
     ProjectDisabledError, ReleaseAlreadyReceivedError
 from .models import Release
 from .tasks import process_release
+from .utils import get_release_options
 
 
 class GitLabReceiver(Receiver):
@@ -35,6 +37,14 @@ class GitLabReceiver(Receiver):
 
     verify_sender = False
 
+    def release_queue(self, release):
+        """Return the queue options for processing a release.
+
+        See ``GITLAB_RELEASE_QUEUES``.
+        """
+        return get_release_options(
+            GitLabAPI(user_id=release.event.user_id), release)
+
     def run(self, event):
         """Process an event."""
         # Handle tag event
@@ -43,10 +53,10 @@ class GitLabReceiver(Receiver):
                 release = Release.create(event)
                 db.session.commit()
 
-                process_release.delay(
-                    release.tag,
-                    str(release.project.id),
-                    verify_sender=self.verify_sender,
+                process_release.apply_async(
+                    args=(release.tag, str(release.project.id)),
+                    kwargs=dict(verify_sender=self.verify_sender),
+                    **self.release_queue(release)
                 )
             except (NoVersionTagError,
                     ProjectDisabledError,
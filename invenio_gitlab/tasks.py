@@ -22,46 +22,76 @@
 from __future__ import absolute_import
 
 import json
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from celery import shared_task
+from celery import chain, shared_task
 from flask import current_app, g
 
 
-@shared_task(ignore_result=True)
-def process_release(tag, project_id, verify_sender=False):
-    """Process a received release from GitLab."""
+def _get_err_obj(msg):
+    """Generate the error entry with a Sentry ID."""
+    err = {'errors': msg}
+    if hasattr(g, 'sentry_event_id'):
+        err['error_id'] = str(g.sentry_event_id)
+    return err
+
+
+def _process_claimed_release(release_model, token, verify_sender=False,
+                             gl=None):
+    """Publish a release claimed with ``token``.
+
+    :param gl: :class:`~invenio_gitlab.api.GitLabAPI` of the release user,
+        shared by the releases of a batch.
+    """
     from invenio_db import db
     from invenio_rest.errors import RESTException
 
-    from .errors import InvalidSenderError
-    from .models import Release, ReleaseStatus
+    from .errors import InvalidSenderError, ReleasePrefetchError
+    from .models import ReleaseStatus
     from .proxies import current_gitlab
 
-    release_model = Release.query.filter(
-        Release.tag == tag,
-        Release.project_id == project_id,
-        Release.status.in_([ReleaseStatus.RECEIVED, ReleaseStatus.FAILED]),
-    ).one()
-    release_model.status = ReleaseStatus.PROCESSING
-    db.session.commit()
-
     release = current_gitlab.release_api_class(release_model)
-    if verify_sender and not release.verify_sender():
-        raise InvalidSenderError(
-            u'Invalid sender for event {event} for user {user}'
-            .format(event=release.event.id, user=release.event.user_id)
-        )
-
-    def _get_err_obj(msg):
-        """Generate the error entry with a Sentry ID."""
-        err = {'errors': msg}
-        if hasattr(g, 'sentry_event_id'):
-            err['error_id'] = str(g.sentry_event_id)
-        return err
+    if gl is not None:
+        release.gl = gl
+    pipeline = current_app.config['GITLAB_RELEASE_PIPELINE']
+    try:
+        if verify_sender and not release.verify_sender():
+            raise InvalidSenderError(
+                u'Invalid sender for event {event} for user {user}'
+                .format(event=release.event.id, user=release.event.user_id)
+            )
+
+        if pipeline:
+            from .utils import get_release_options
+
+            # Every stage runs in the queue of the release, as a chain only
+            # passes the options of ``apply_async`` to its first task. Stages
+            # completed by a previous attempt are skipped.
+            options = get_release_options(release.gl, release_model)
+            chain(
+                run_release_stage.si(str(release_model.id), stage, token)
+                .set(**options)
+                for stage in release.stages
+            ).apply_async()
+            return
+    except Exception:
+        if pipeline:
+            # The pipeline frees the slots once it has finished, but it has
+            # not been started.
+            _free_leases(release_model.id, token)
+            db.session.commit()
+        raise
 
     try:
         release.publish()
         release.model.status = ReleaseStatus.PUBLISHED
+    except ReleasePrefetchError as exc:
+        release.model.errors = _get_err_obj(str(exc))
+        release.model.status = ReleaseStatus.FAILED
+        current_app.logger.exception(
+            u'Error while processing {release}'.format(release=release.model))
     except RESTException as rest_ex:
         release.model.errors = json.loads(rest_ex.get_body())
         release.model.status = ReleaseStatus.FAILED
@@ -76,24 +106,376 @@ def process_release(tag, project_id, verify_sender=False):
         db.session.commit()
 
 
-@shared_task(max_retries=6, default_retry_delay=10 * 60, rate_limit='100/m')
-def disconnect_gitlab(access_token, project_webhooks):
-    """Uninstall webhooks."""
-    import gitlab
+def _lease_token(release_id, token):
+    """Return the token of the leases held for a release by a task."""
+    return u'{0}:{1}'.format(token, release_id)
+
+
+def _acquire_leases(release_model, token):
+    """Take the concurrency slots of a release's project and user."""
+    from .models import ReleaseLease
+
+    limits = {}
+    project_limit = current_app.config['GITLAB_RELEASE_PROJECT_CONCURRENCY']
+    if project_limit:
+        limits[u'project:{0}'.format(release_model.project_id)] = \
+            project_limit
+    user_limit = current_app.config['GITLAB_RELEASE_USER_CONCURRENCY']
+    if user_limit and release_model.event is not None:
+        limits[u'user:{0}'.format(release_model.event.user_id)] = user_limit
+    if not limits:
+        return True
+    return ReleaseLease.acquire_all(
+        limits, _lease_token(release_model.id, token),
+        current_app.config['GITLAB_RELEASE_LEASE_TTL'])
+
+
+def _free_leases(release_id, token):
+    """Free the concurrency slots held for a release by a task."""
+    from .models import ReleaseLease
+
+    ReleaseLease.release(_lease_token(release_id, token))
+
+
+@shared_task(bind=True, ignore_result=True)
+def process_release(self, tag, project_id, verify_sender=False):
+    """Process a received release from GitLab.
+
+    The release is claimed with the id of the task, so concurrent or
+    duplicate tasks of the same release do nothing, while a redelivered
+    task resumes its own claim. Releases over the concurrency limits of
+    their project or user are deferred.
+    """
+    from invenio_db import db
+
+    from .models import Release
+
+    token = self.request.id or str(uuid.uuid4())
+    release_model = Release.query.filter_by(
+        tag=tag, project_id=project_id).one()
+    release_id = release_model.id
+    if not _acquire_leases(release_model, token):
+        db.session.commit()
+        countdown = current_app.config['GITLAB_RELEASE_DEFER_COUNTDOWN']
+        current_app.logger.info(
+            u'Deferring {release} over the concurrency limits.'
+            .format(release=release_model))
+        # Spread the deferred tasks, so they do not all return at once.
+        raise self.retry(
+            countdown=countdown.total_seconds() * random.uniform(1, 2),
+            max_retries=None)
+
+    release_model = Release.claim(tag, project_id, token)
+    if release_model is None:
+        _free_leases(release_id, token)
+        db.session.commit()
+        current_app.logger.info(
+            u'Release {tag} of project {project} is already processed.'
+            .format(tag=tag, project=project_id))
+        return
+    db.session.commit()
+
     try:
-        gl = gitlab.Gitlab(current_app.config['GITLAB_BASE_URL'],
-                           oauth_token=access_token)
-        for project_id, project_hook in project_webhooks:
-            project = gl.projects.get(project_id)
-            # Check, if hook is already installed.
-            hook = project.hooks.get(project_hook)
-            if hook and hook.delete():
-                info_msg = u'Deleted hook {hook} from {project}'.format(
-                    hook=hook.id, project=project.full_name)
-                current_app.logger.info(info_msg)
-        # FIXME: Oauth token revocation is currently not possible via
-        # GitLab's API. We can just drop the token from our DB, as already
-        # done before this task. Relevant issue on GitLab:
-        # https://gitlab.com/gitlab-org/gitlab-ce/issues/48503
+        _process_claimed_release(release_model, token, verify_sender)
+    finally:
+        # The publish pipeline frees the slots once it has finished.
+        if not current_app.config['GITLAB_RELEASE_PIPELINE']:
+            _free_leases(release_id, token)
+            db.session.commit()
+
+
+@shared_task(bind=True, ignore_result=True)
+def process_release_batch(self, limit=None, verify_sender=False):
+    """Process a batch of received releases in one task.
+
+    Up to ``limit`` releases are claimed with one query. The releases of a
+    user share one pooled GitLab client and all of them are processed by
+    at most ``GITLAB_RELEASE_BATCH_WORKERS`` threads.
+    """
+    from invenio_db import db
+
+    from .api import GitLabAPI
+    from .models import Release, ReleaseStatus
+
+    token = self.request.id or str(uuid.uuid4())
+    limit = limit or current_app.config['GITLAB_RELEASE_BATCH_SIZE']
+    groups = {}
+    for release_model in Release.claim_received(token, limit):
+        groups.setdefault(release_model.event.user_id, []).append(
+            release_model.id)
+    db.session.commit()
+
+    # Resolve the token and client of each user once for the whole batch.
+    clients = {}
+    for user_id in groups:
+        gl = GitLabAPI(user_id=user_id)
+        try:
+            clients[user_id] = (gl.access_token, gl.api)
+        except Exception:
+            current_app.logger.exception(
+                u'Cannot create GitLab client of user {0}'.format(user_id))
+
+    app = current_app._get_current_object()
+
+    def process(user_id, release_id):
+        with app.app_context():
+            gl = GitLabAPI(user_id=user_id)
+            if user_id in clients:
+                gl.access_token, gl.api = clients[user_id]
+            release_model = Release.query.get(release_id)
+            if not _acquire_leases(release_model, token):
+                # Leave the release to a later batch.
+                release_model.status = ReleaseStatus.RECEIVED
+                release_model.claim_token = None
+                db.session.commit()
+                return
+            db.session.commit()
+            try:
+                _process_claimed_release(
+                    release_model, token, verify_sender, gl=gl)
+            except Exception as exc:
+                db.session.rollback()
+                release_model.errors = _get_err_obj(str(exc))
+                release_model.status = ReleaseStatus.FAILED
+                db.session.commit()
+                current_app.logger.exception(
+                    u'Error while processing {release}'.format(
+                        release=release_model))
+            finally:
+                if not current_app.config['GITLAB_RELEASE_PIPELINE']:
+                    _free_leases(release_id, token)
+                    db.session.commit()
+
+    workers = current_app.config['GITLAB_RELEASE_BATCH_WORKERS']
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(process, user_id, release_id)
+            for user_id, release_ids in groups.items()
+            for release_id in release_ids
+        ]
+        for future in futures:
+            future.result()
+
+
+@shared_task(ignore_result=True)
+def drain_releases():
+    """Dispatch batches of received releases when many are queued.
+
+    Schedule it with ``CELERY_BEAT_SCHEDULE``. Batches are only dispatched
+    if more than ``GITLAB_RELEASE_DRAIN_THRESHOLD`` releases wait to be
+    processed, counting releases whose claim expired.
+
+    Batches mix repositories of any size, so they bypass
+    ``GITLAB_RELEASE_QUEUES`` and run in the default queue. With
+    ``GITLAB_RELEASE_PIPELINE`` the stages of each release are still routed
+    by its repository size.
+    """
+    from .models import Release
+
+    depth = Release.query.filter(Release.claimable()).count()
+    if depth <= current_app.config['GITLAB_RELEASE_DRAIN_THRESHOLD']:
+        return
+    size = current_app.config['GITLAB_RELEASE_BATCH_SIZE']
+    batches = min(-(-depth // size),
+                  current_app.config['GITLAB_RELEASE_DRAIN_MAX_BATCHES'])
+    current_app.logger.info(
+        u'Dispatching {0} batches for {1} received releases.'.format(
+            batches, depth))
+    for _ in range(batches):
+        process_release_batch.delay(size)
+
+
+def _is_permanent_error(exc):
+    """Return True, if retrying a release stage cannot fix the error."""
+    from gitlab import GitlabHttpError
+    from invenio_rest.errors import RESTException
+
+    from .errors import GitLabError, ReleasePrefetchError
+
+    if isinstance(exc, ReleasePrefetchError):
+        return any(_is_permanent_error(e) for e in exc.errors.values())
+    if isinstance(exc, GitlabHttpError):
+        return exc.response_code is not None and \
+            exc.response_code < 500 and exc.response_code != 429
+    return isinstance(exc, (GitLabError, RESTException))
+
+
+@shared_task(bind=True, ignore_result=True)
+def run_release_stage(self, release_id, stage, claim_token=None):
+    """Run one stage of the publish pipeline of a release.
+
+    Failed stages are retried with an exponential backoff, while the results
+    of the completed stages are kept. The release fails once the retries
+    are exhausted or on errors which a retry cannot fix. Stages of a
+    pipeline whose claim has been taken over by another task are skipped.
+    """
+    from invenio_db import db
+    from invenio_rest.errors import RESTException
+
+    from .models import Release, ReleaseStatus
+    from .proxies import current_gitlab
+
+    release_model = Release.query.get(release_id)
+    if claim_token and release_model.claim_token != claim_token:
+        current_app.logger.info(
+            u'Skipping stage {stage} of {release} claimed by another task.'
+            .format(stage=stage, release=release_model))
+        _free_leases(release_id, claim_token)
+        db.session.commit()
+        return
+    release = current_gitlab.release_api_class(release_model)
+    try:
+        release.run_stage(stage)
+        if stage == release.stages[-1] and claim_token:
+            _free_leases(release_id, claim_token)
+        db.session.commit()
     except Exception as exc:
-        disconnect_gitlab.retry(exc=exc)
+        db.session.rollback()
+        max_retries = current_app.config['GITLAB_RELEASE_STAGE_MAX_RETRIES']
+        if not _is_permanent_error(exc) and self.request.retries < max_retries:
+            current_app.logger.warning(
+                u'Retrying stage {stage} of {release}: {exc}'.format(
+                    stage=stage, release=release_model, exc=exc))
+            delay = current_app.config['GITLAB_RELEASE_STAGE_RETRY_DELAY']
+            raise self.retry(
+                exc=exc, max_retries=max_retries,
+                countdown=delay.total_seconds() * 2 ** self.request.retries)
+        if isinstance(exc, RESTException):
+            release_model.errors = json.loads(exc.get_body())
+        else:
+            release_model.errors = _get_err_obj(
+                str(exc) or 'Unknown error occured.')
+        release_model.status = ReleaseStatus.FAILED
+        if claim_token:
+            _free_leases(release_id, claim_token)
+        db.session.commit()
+        current_app.logger.exception(
+            u'Error in stage {stage} of {release}'.format(
+                stage=stage, release=release_model))
+        try:
+            release.discard_staged_archive()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception(
+                u'Cannot discard the staged archive of {release}'.format(
+                    release=release_model))
+        raise
+
+
+@shared_task(ignore_result=True)
+def sync_account(user_id, full=None):
+    """Synchronize the projects of a user in the background."""
+    from invenio_db import db
+
+    from .api import GitLabAPI
+
+    gitlab = GitLabAPI(user_id=user_id)
+    try:
+        gitlab.sync(full=full)
+    except Exception:
+        db.session.rollback()
+        # Allow the next page view to request a new sync.
+        gitlab.account.extra_data.pop('sync_requested', None)
+        gitlab.account.extra_data.changed()
+        raise
+    finally:
+        db.session.commit()
+
+
+@shared_task(ignore_result=True)
+def sync_hooks(user_id, project_hooks):
+    """Check the installed webhooks of a user's projects."""
+    from invenio_db import db
+
+    from .api import GitLabAPI
+
+    GitLabAPI(user_id=user_id).check_hooks(
+        [tuple(project_hook) for project_hook in project_hooks])
+    db.session.commit()
+
+
+@shared_task(ignore_result=True)
+def prune_release_archives():
+    """Remove index entries of release archives that are no longer used.
+
+    Spooled archives older than ``GITLAB_ARCHIVE_SPOOL_MAX_AGE`` are deleted
+    as well. Schedule it with ``CELERY_BEAT_SCHEDULE`` before the file
+    cleanup of Invenio-Files-REST.
+    """
+    from invenio_db import db
+
+    from .archive import SpooledArchive
+    from .models import ReleaseArchive
+
+    removed = ReleaseArchive.prune()
+    db.session.commit()
+    current_app.logger.info(
+        u'Removed {0} unused release archives from the index.'.format(removed))
+
+    if current_app.config['GITLAB_ARCHIVE_SPOOL']:
+        removed = SpooledArchive.sweep(
+            current_app.config['GITLAB_ARCHIVE_SPOOL_DIR'],
+            current_app.config['GITLAB_ARCHIVE_SPOOL_MAX_AGE'])
+        current_app.logger.info(
+            u'Removed {0} stale spooled archives.'.format(removed))
+
+
+@shared_task(bind=True, max_retries=6, default_retry_delay=10 * 60,
+             rate_limit='100/m')
+def disconnect_gitlab(self, access_token, project_webhooks):
+    """Uninstall webhooks.
+
+    The hooks are deleted concurrently, chunk by chunk. Hooks which are
+    already gone count as deleted, and only the hooks which could not be
+    deleted are retried.
+    """
+    from gitlab import GitlabDeleteError
+
+    from .proxies import current_gitlab
+    from .utils import chunked
+
+    try:
+        gl = current_gitlab.client_pool.get(
+            current_app.config['GITLAB_BASE_URL'], access_token)
+    except Exception as exc:
+        raise self.retry(exc=exc)
+    # FIXME: Oauth token revocation is currently not possible via
+    # GitLab's API. We can just drop the token from our DB, as already
+    # done before this task. Relevant issue on GitLab:
+    # https://gitlab.com/gitlab-org/gitlab-ce/issues/48503
+
+    app = current_app._get_current_object()
+
+    def delete(project_id, hook_id):
+        with app.app_context():
+            try:
+                gl.projects.get(project_id, lazy=True).hooks.delete(hook_id)
+            except GitlabDeleteError as exc:
+                if exc.response_code != 404:
+                    raise
+            current_app.logger.info(
+                u'Deleted hook {hook} from project {project}'.format(
+                    hook=hook_id, project=project_id))
+
+    remaining, error = [], None
+    workers = current_app.config['GITLAB_DISCONNECT_WORKERS']
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk in chunked(
+                project_webhooks,
+                current_app.config['GITLAB_DISCONNECT_CHUNK_SIZE']):
+            futures = [
+                (project_hook, pool.submit(delete, *project_hook))
+                for project_hook in chunk
+            ]
+            for project_hook, future in futures:
+                try:
+                    future.result()
+                except Exception as exc:
+                    remaining.append(list(project_hook))
+                    error = exc
+    if remaining:
+        current_app.logger.warning(
+            u'Could not delete {0} of {1} hooks: {2}'.format(
+                len(remaining), len(project_webhooks), error))
+        raise self.retry(args=(access_token, remaining), exc=error)
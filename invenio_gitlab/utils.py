@@ -21,13 +21,15 @@
 
 from __future__ import absolute_import
 
-import base64
+import itertools
 import json
+from contextlib import closing
 from datetime import datetime
 
 import dateutil.parser
 import pytz
 from flask import current_app
+from gitlab import GitlabGetError
 
 from .errors import CustomGitLabMetadataError
 
@@ -50,11 +52,25 @@ def parse_timestamp(x):
     return dt
 
 
-def get_contributors(gl, project_id):
-    """Return contributors of GitLab project."""
+def chunked(iterable, size):
+    """Split an iterable into lists of at most ``size`` items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_contributors(gl, project_id, project=None):
+    """Return contributors of GitLab project.
+
+    Pass the ``project`` handle of a release to avoid fetching it again.
+    """
     try:
         contributors = []
-        project = gl.api.projects.get(project_id)
+        if project is None:
+            project = gl.api.projects.get(project_id, lazy=True)
         for contributor in project.repository_contributors(as_list=False):
             if contributor['name']:
                 contributors.append(dict(
@@ -63,29 +79,115 @@ def get_contributors(gl, project_id):
                 ))
         return contributors
     except Exception:
+        current_app.logger.exception(
+            u'Could not fetch the contributors of project {0}.'
+            .format(project_id))
         return None
 
 
-def get_extra_metadata(gl, project_id, tag):
-    """Extract extra metadata from the metadata file."""
+def get_extra_metadata(gl, project_id, sha, project=None):
+    """Extract extra metadata from the metadata file.
+
+    The file is fetched by path at the given commit. As its content can never
+    change for a commit, the parsed metadata is cached per project and commit.
+    Pass the ``project`` handle of a release to avoid fetching it again.
+    """
+    from .proxies import current_gitlab
+
+    filename = current_app.config['GITLAB_METADATA_FILE']
+    key = u'metadata:{0}:{1}:{2}'.format(project_id, sha, filename)
+    metadata = current_gitlab.cache.get(key)
+    if metadata is not None:
+        return metadata
+
+    if project is None:
+        project = gl.api.projects.get(project_id, lazy=True)
+    content = _fetch_metadata_file(project, sha, filename)
     try:
-        project = gl.api.projects.get(project_id)
-        items = project.repository_tree(ref=tag)
-        try:
-            file_id = [element['id'] for element in items if
-                       element['name'] ==
-                       current_app.config['GITLAB_METADATA_FILE']][0]
-        except IndexError:
-            file_id = None
-        if file_id:
-            file_info = project.repository_blob(file_id)
-            content = base64.b64decode(file_info['content'])
-            if not content:
-                return {}
-            return json.loads(content.decode('utf-8'))
-        return {}
+        metadata = json.loads(content.decode('utf-8')) if content else {}
     except ValueError:
         raise CustomGitLabMetadataError(
             u'Metadata file "{file}" is not valid JSON.'
-            .format(file=current_app.config['GITLAB_METADATA_FILE'])
+            .format(file=filename)
         )
+    ttl = current_app.config['GITLAB_METADATA_CACHE_TTL']
+    current_gitlab.cache.set(
+        key, metadata, ttl=ttl.total_seconds() if ttl else None)
+    return metadata
+
+
+def get_repository_size(gl, project_id):
+    """Return the repository size of a GitLab project in bytes.
+
+    The size is read from the project statistics and cached per project.
+    """
+    from .proxies import current_gitlab
+
+    key = u'repository_size:{0}'.format(project_id)
+    size = current_gitlab.cache.get(key)
+    if size is not None:
+        return size
+
+    project = gl.api.projects.get(project_id, statistics=True)
+    size = project.statistics['repository_size']
+    ttl = current_app.config['GITLAB_REPOSITORY_SIZE_CACHE_TTL']
+    current_gitlab.cache.set(
+        key, size, ttl=ttl.total_seconds() if ttl else None)
+    return size
+
+
+def get_release_queue(size):
+    """Return the ``apply_async`` options for a repository of a given size.
+
+    :param int size: Repository size in bytes, or ``None`` if unknown.
+    :returns: Options of the first queue of ``GITLAB_RELEASE_QUEUES`` which
+        fits the repository, or of the last queue.
+    """
+    queues = current_app.config['GITLAB_RELEASE_QUEUES']
+    for queue in queues:
+        max_size = queue.get('max_size')
+        if max_size is None or (size is not None and size <= max_size):
+            break
+    return {k: v for k, v in queue.items() if k != 'max_size'}
+
+
+def get_release_options(gl, release):
+    """Return the ``apply_async`` options for processing a release.
+
+    :param gl: :class:`~invenio_gitlab.api.GitLabAPI` of the release user.
+    :param release: :class:`~invenio_gitlab.models.Release` to process.
+    """
+    if not current_app.config['GITLAB_RELEASE_QUEUES']:
+        return {}
+    try:
+        size = get_repository_size(gl, release.project.gitlab_id)
+    except Exception:
+        current_app.logger.warning(
+            u'Could not get the repository size of {project}.'
+            .format(project=release.project), exc_info=True)
+        size = None
+    return get_release_queue(size)
+
+
+def _fetch_metadata_file(project, sha, filename):
+    """Return the raw content of the metadata file, or None if missing."""
+    max_size = current_app.config['GITLAB_METADATA_FILE_MAX_SIZE']
+    try:
+        chunks = project.files.raw(
+            file_path=filename, ref=sha, streamed=True, iterator=True,
+            chunk_size=64 * 1024)
+        content = bytearray()
+        # Stop reading the response of files over the size limit.
+        with closing(chunks):
+            for chunk in chunks:
+                content += chunk
+                if max_size and len(content) > max_size:
+                    raise CustomGitLabMetadataError(
+                        u'Metadata file "{file}" is larger than {size} '
+                        u'bytes.'.format(file=filename, size=max_size)
+                    )
+    except GitlabGetError as exc:
+        if exc.response_code == 404:
+            return None
+        raise
+    return bytes(content)
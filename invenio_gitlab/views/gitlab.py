@@ -20,7 +20,7 @@
 """GitLab settings blueprint for Invenio."""
 
 import humanize
-from flask import Blueprint, abort, current_app, render_template, request
+from flask import Blueprint, abort, current_app, jsonify, render_template, request
 from flask_login import current_user, login_required
 from invenio_db import db
 from invenio_i18n import lazy_gettext as _
@@ -28,8 +28,9 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from ..api import GitLabAPI, GitLabRelease
 from ..errors import ProjectAccessError
-from ..models import Project, Release
+from ..models import AccountProject, Project, Release
 from ..proxies import current_gitlab
+from ..tasks import sync_account
 from ..utils import parse_timestamp, utcnow
 
 
@@ -71,23 +72,37 @@ def register_ui_routes(blueprint):
                 db.session.commit()
 
             if request.method == "POST" or gitlab.check_sync():
-                # When we're in an XHR request, synchronously sync hooks
-                gitlab.sync(async_hooks=(not request.is_xhr))
-                db.session.commit()
+                # A manual sync always reconciles all projects.
+                full = (request.method == "POST") or None
+                if current_app.config["GITLAB_BACKGROUND_SYNC"]:
+                    # Render the stored projects and refresh them in a task.
+                    if gitlab.request_sync():
+                        db.session.commit()
+                        sync_account.delay(current_user.id, full=full)
+                else:
+                    # When we're in an XHR request, synchronously sync hooks
+                    gitlab.sync(async_hooks=(not request.is_xhr), full=full)
+                    db.session.commit()
 
-            # Generate the projects view object
+            # Generate the projects view object, enhanced from the database.
             extra_data = gitlab.account.extra_data
-            projects = extra_data["projects"]
-            if projects:
-                # Enhance the projects dict, from the database model.
-                db_projects = Project.query.filter(
-                    Project.gitlab_id.in_([int(k) for k in projects.keys()]),
-                ).all()
-                for project in db_projects:
-                    projects[str(project.gitlab_id)]["instance"] = project
-                    projects[str(project.gitlab_id)]["latest"] = GitLabRelease(
-                        project.latest_release()
-                    )
+            rows = (
+                db.session.query(AccountProject, Project)
+                .outerjoin(Project, Project.gitlab_id == AccountProject.gitlab_id)
+                .filter(AccountProject.account_id == gitlab.account.id)
+                .order_by(AccountProject.full_name)
+            )
+            projects = []
+            for account_project, project in rows:
+                item = dict(
+                    id=account_project.gitlab_id,
+                    full_name=account_project.full_name,
+                    description=account_project.description,
+                )
+                if project:
+                    item["instance"] = project
+                    item["latest"] = GitLabRelease(project.latest_release())
+                projects.append((str(account_project.gitlab_id), item))
 
             last_sync = humanize.naturaltime(
                 (utcnow() - parse_timestamp(extra_data["last_sync"]))
@@ -96,14 +111,25 @@ def register_ui_routes(blueprint):
             ctx.update(
                 {
                     "connected": True,
-                    "projects": sorted(
-                        projects.items(), key=lambda x: x[1]["full_name"]
-                    ),
+                    "projects": projects,
                     "last_sync": last_sync,
+                    "refreshing": gitlab.sync_pending,
                 }
             )
         return render_template(current_app.config["GITLAB_TEMPLATE_INDEX"], **ctx)
 
+    @blueprint.route("/sync")
+    @login_required
+    def sync_status():
+        """Return the state of the background sync of the current user."""
+        gitlab = GitLabAPI(user_id=current_user.id)
+        if not gitlab.account:
+            abort(404)
+        return jsonify(
+            refreshing=gitlab.sync_pending,
+            last_sync=gitlab.account.extra_data.get("last_sync"),
+        )
+
     @blueprint.route("/project/<path:name>")
     @login_required
     def project(name):
@@ -112,27 +138,21 @@ def register_ui_routes(blueprint):
         gitlab = GitLabAPI(user_id=user_id)
         token = gitlab.session_token
         if token:
-            projects = gitlab.account.extra_data.get("projects", [])
-            project = next(
-                (
-                    project
-                    for project_id, project in projects.items()
-                    if project.get("full_name") == name
-                ),
-                {},
-            )
+            project = AccountProject.query.filter_by(
+                account_id=gitlab.account.id, full_name=name
+            ).first()
             if not project:
                 abort(403)
 
             try:
                 project_instance = Project.get(
-                    user_id=user_id, gitlab_id=project["id"], check_owner=False
+                    user_id=user_id, gitlab_id=project.gitlab_id, check_owner=False
                 )
             except ProjectAccessError:
                 abort(403)
             except NoResultFound:
                 project_instance = Project(
-                    name=project["full_name"], gitlab_id=project["id"]
+                    name=project.full_name, gitlab_id=project.gitlab_id
                 )
             releases = [
                 current_gitlab.release_api_class(r)
@@ -156,17 +176,22 @@ def register_api_routes(blueprint):
     @login_required
     def hook():
         """Install or delete GitLab webhook."""
-        project_id = request.json["id"]
+        try:
+            project_id = int(request.json["id"])
+        except (TypeError, ValueError):
+            abort(404)
 
         gitlab = GitLabAPI(user_id=current_user.id)
-        projects = gitlab.account.extra_data["projects"]
+        project = AccountProject.query.filter_by(
+            account_id=gitlab.account.id, gitlab_id=project_id
+        ).first()
 
-        if project_id not in projects:
+        if not project:
             abort(404)
 
         if request.method == "DELETE":
             try:
-                if gitlab.remove_hook(project_id, projects[project_id]["full_name"]):
+                if gitlab.remove_hook(project_id, project.full_name):
                     db.session.commit()
                     return "", 204
                 else:
@@ -175,7 +200,7 @@ def register_api_routes(blueprint):
                 abort(403)
         elif request.method == "POST":
             try:
-                if gitlab.create_hook(project_id, projects[project_id]["full_name"]):
+                if gitlab.create_hook(project_id, project.full_name):
                     db.session.commit()
                     return "", 201
                 else:
@@ -213,3 +238,32 @@ def register_api_routes(blueprint):
             project_instance.release_pattern = "v*"
             db.session.commit()
             return "", 204
+
+    @blueprint.route("/archive-format", methods=["POST", "DELETE"])
+    @login_required
+    def archive_format():
+        """Change the format of the repository archives of releases."""
+        project_id = request.json.get("id", None)
+        if not project_id:
+            abort(400, _("Specify the project ID."))
+
+        try:
+            project_instance = Project.get(
+                user_id=current_user.id, gitlab_id=project_id, check_owner=True
+            )
+        except NoResultFound:
+            abort(403)
+
+        if request.method == "POST":
+            archive_format = request.json.get("format", None)
+            if archive_format not in current_app.config["GITLAB_ARCHIVE_FORMATS"]:
+                abort(400, _("Specify a supported archive format."))
+
+            project_instance.archive_format = archive_format
+            db.session.commit()
+            return "", 204
+        elif request.method == "DELETE":
+            # Use the format configured for the installation.
+            project_instance.archive_format = None
+            db.session.commit()
+            return "", 204
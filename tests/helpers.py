@@ -111,21 +111,32 @@ class GLProjects(object):
 class ProjectList(object):
     """GitLab project lists mock."""
 
-    def list(self, owned=False, simple=False):
+    def __init__(self, projects=None):
+        """Init project list."""
+        self.projects = projects
+        self.list_calls = []
+
+    def list(self, owned=False, simple=False, **kwargs):
         """List GitLab projects."""
-        return [GLProjects()]
+        self.list_calls.append(kwargs)
+        if self.projects is None:
+            return [GLProjects()]
+        return list(self.projects)
 
-    def get(self, project_id):
+    def get(self, project_id, **kwargs):
         """Return project."""
-        return self.list()[0]
+        if self.projects is None:
+            return GLProjects()
+        return self.projects[0]
 
 
 class GitlabMock(object):
     """Mock GitLab API."""
 
-    def __init__(self, server, oauth_token, email='info@hzdr.de'):
+    def __init__(self, server, oauth_token, email='info@hzdr.de', **kwargs):
         """Init mock."""
         self.user = GLUser(email)
+        self._projects = ProjectList()
 
     def auth(self):
         """Mock auth."""
@@ -134,4 +145,13 @@ class GitlabMock(object):
     @property
     def projects(self):
         """Gitlab projects API."""
-        return ProjectList()
+        return self._projects
+
+    def http_list(self, path, query_data=None, **kwargs):
+        """List the attributes of GitLab objects."""
+        assert path == '/projects'
+        query_data = dict(query_data or {})
+        query_data.pop('owned', None)
+        query_data.pop('simple', None)
+        return [project.attributes
+                for project in self._projects.list(**query_data)]
@@ -0,0 +1,662 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the GitLab API wrapper."""
+
+import threading
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+import gitlab
+import pytest
+import requests
+from celery.exceptions import Retry
+from gitlab import GitlabGetError
+from helpers import GitlabMock, GLProjects, mock
+from invenio_files_rest.models import Bucket, Location, ObjectVersion
+from invenio_oauthclient.models import RemoteAccount
+from invenio_rest.errors import RESTException
+from invenio_webhooks.models import Event
+
+from invenio_gitlab.api import GitLabAPI, GitLabRelease
+from invenio_gitlab.cache import MemoryCache
+from invenio_gitlab.client import GitLabSession
+from invenio_gitlab.errors import (
+    CustomGitLabMetadataError,
+    InvalidSenderError,
+    ReleasePrefetchError,
+)
+from invenio_gitlab.models import (
+    AccountProject,
+    Project,
+    Release,
+    ReleaseArchive,
+    ReleaseLease,
+    ReleaseStatus,
+)
+from invenio_gitlab.tasks import (
+    drain_releases,
+    process_release,
+    run_release_stage,
+)
+from invenio_gitlab.utils import get_extra_metadata, iso_utcnow, utcnow
+
+
+@pytest.fixture()
+def gitlab_api(app, db, user):
+    """GitLab API object with a mocked GitLab client."""
+    RemoteAccount.create(user.id, 'gitlab_key_changeme', dict(
+        id=1234,
+        login='test',
+        name='Test Test',
+        tokens=dict(webhook=None),
+        last_sync=iso_utcnow(),
+    ))
+    db.session.commit()
+    gl = GitLabAPI(user_id=user.id)
+    gl.api = GitlabMock('https://gitlab.com', oauth_token='test')
+    return gl
+
+
+def synced_projects(gitlab_api):
+    """Return the GitLab ids of the cached projects."""
+    return {p.gitlab_id for p in AccountProject.query.filter_by(
+        account_id=gitlab_api.account.id)}
+
+
+def test_sync_incremental(app, db, user, gitlab_api):
+    """Test incremental and full project synchronisation."""
+    projects = gitlab_api.api.projects
+    projects.projects = [GLProjects(1, 'one', 'test/one'),
+                         GLProjects(2, 'two', 'test/two')]
+    Project.create(user.id, gitlab_id=1, name='test/old')
+    Project.create(user.id, gitlab_id=3, name='test/three')
+    db.session.commit()
+
+    gitlab_api.sync(hooks=False)
+    db.session.commit()
+    # The first sync is a full one.
+    assert 'last_activity_after' not in projects.list_calls[-1]
+    assert synced_projects(gitlab_api) == {1, 2}
+    assert Project.query.filter_by(gitlab_id=1).one().name == 'test/one'
+    assert Project.query.filter_by(gitlab_id=3).one().user_id is None
+
+    # Only recently active projects are listed and merged.
+    projects.projects = [GLProjects(4, 'four', 'test/four')]
+    gitlab_api.sync(hooks=False)
+    db.session.commit()
+    assert 'last_activity_after' in projects.list_calls[-1]
+    assert synced_projects(gitlab_api) == {1, 2, 4}
+
+    # A forced full sync drops projects that are gone.
+    gitlab_api.sync(hooks=False, full=True)
+    db.session.commit()
+    assert synced_projects(gitlab_api) == {4}
+
+
+def test_check_full_sync(app, db, gitlab_api):
+    """Test the full sync interval."""
+    assert gitlab_api.check_full_sync()
+    gitlab_api.account.extra_data['last_full_sync'] = iso_utcnow()
+    assert not gitlab_api.check_full_sync()
+    gitlab_api.account.extra_data['last_full_sync'] = (
+        utcnow() - timedelta(days=8)).isoformat()
+    assert gitlab_api.check_full_sync()
+    app.config['GITLAB_FULL_SYNC_TIMEDELTA'] = None
+    gitlab_api.account.extra_data['last_full_sync'] = iso_utcnow()
+    assert gitlab_api.check_full_sync()
+
+
+def test_check_hooks(app, db, user, gitlab_api):
+    """Test that projects with missing webhooks are disabled."""
+    for gitlab_id in (1, 2, 3):
+        Project.enable(user.id, gitlab_id, 'test/{0}'.format(gitlab_id),
+                       hook=10 + gitlab_id)
+    db.session.commit()
+
+    def get_hook(hook_id):
+        if hook_id == 12:
+            raise GitlabGetError(response_code=404)
+        if hook_id == 13:
+            raise GitlabGetError(response_code=500)
+        return mock.MagicMock(attributes=dict(url='http://example.org'))
+
+    api = mock.MagicMock()
+    api.projects.get.return_value.hooks.get.side_effect = get_hook
+    gitlab_api.api = api
+    gitlab_api.webhook_url = 'http://example.org'
+
+    missing = gitlab_api.check_hooks([(1, 11), (2, 12), (3, 13)])
+    db.session.commit()
+    assert missing == [2]
+    assert Project.query.filter_by(gitlab_id=1).one().enabled
+    assert not Project.query.filter_by(gitlab_id=2).one().enabled
+    # Hooks that could not be checked are kept.
+    assert Project.query.filter_by(gitlab_id=3).one().enabled
+
+
+def test_request_sync(app, db, gitlab_api):
+    """Test deduplication of background syncs."""
+    assert not gitlab_api.sync_pending
+    assert gitlab_api.request_sync()
+    db.session.commit()
+    assert gitlab_api.sync_pending
+    assert not gitlab_api.request_sync()
+
+    # A finished sync clears the request.
+    gitlab_api.sync(hooks=False)
+    db.session.commit()
+    assert not gitlab_api.sync_pending
+
+    # Stale requests do not block new ones.
+    gitlab_api.account.extra_data['sync_requested'] = (
+        utcnow() - timedelta(hours=1)).isoformat()
+    assert not gitlab_api.sync_pending
+    assert gitlab_api.request_sync()
+
+
+def test_release_archive_format(app, db, release):
+    """Test the archive format of releases."""
+    gl_release = GitLabRelease(release)
+    assert gl_release.filename == 'example-v1.0.0.zip'
+    assert gl_release.archive_mimetype == 'application/zip'
+
+    release.project.archive_format = 'tar.gz'
+    gl_release = GitLabRelease(release)
+    assert gl_release.filename == 'example-v1.0.0.tar.gz'
+    assert gl_release.archive_mimetype == 'application/gzip'
+
+
+def test_get_extra_metadata(app, db, gitlab_api):
+    """Test fetching the metadata file of a release commit."""
+    project = GLProjects()
+    project.files = mock.MagicMock()
+    gitlab_api.api.projects.projects = [project]
+    sha = 'a' * 40
+
+    # python-gitlab returns the chunks of the response as a generator.
+    project.files.raw.return_value = (
+        chunk for chunk in [b'{"title": ', b'"Test"}'])
+    assert get_extra_metadata(gitlab_api, 1234, sha) == {'title': 'Test'}
+    project.files.raw.assert_called_once_with(
+        file_path='.invenio.json', ref=sha, streamed=True, iterator=True,
+        chunk_size=64 * 1024)
+    # The metadata of a commit is cached.
+    assert get_extra_metadata(gitlab_api, 1234, sha) == {'title': 'Test'}
+    assert project.files.raw.call_count == 1
+
+    project.files.raw.side_effect = GitlabGetError(response_code=404)
+    assert get_extra_metadata(gitlab_api, 1234, 'b' * 40) == {}
+
+    project.files.raw.side_effect = None
+    project.files.raw.return_value = (chunk for chunk in [b'{"title"'])
+    with pytest.raises(CustomGitLabMetadataError):
+        get_extra_metadata(gitlab_api, 1234, 'c' * 40)
+
+    # The response of files over the size limit is closed.
+    app.config['GITLAB_METADATA_FILE_MAX_SIZE'] = 10
+    chunks = mock.MagicMock()
+    chunks.__iter__.return_value = iter([b'{"title": ', b'"Test"}'])
+    project.files.raw.return_value = chunks
+    with pytest.raises(CustomGitLabMetadataError):
+        get_extra_metadata(gitlab_api, 1234, 'd' * 40)
+    chunks.close.assert_called_once_with()
+
+
+def test_release_tag(app, db, release):
+    """Test building the tag metadata from the webhook payload."""
+    gl_release = GitLabRelease(release)
+    gl_release.payload['commits'] = [dict(
+        id=gl_release.commit_sha, timestamp='2019-02-03T10:00:00+01:00')]
+    # The commit API is not asked.
+    with mock.patch.object(GitLabRelease, 'commit',
+                           new_callable=mock.PropertyMock,
+                           side_effect=AssertionError) as commit:
+        assert gl_release.tag == dict(
+            name='v1.0.0',
+            commit=dict(id=gl_release.commit_sha,
+                        created_at='2019-02-03T10:00:00+01:00'),
+        )
+        assert gl_release.defaults['publication_date'] == '2019-02-03'
+    assert not commit.called
+    assert gl_release.remote_fields == set()
+
+    # Fall back to the commit API if the payload lacks the commit.
+    gl_release = GitLabRelease(release)
+    gl_release.payload['commits'] = []
+    gl_release.commit = dict(created_at='2019-01-01T00:00:00Z')
+    assert gl_release.tag['commit']['created_at'] == '2019-01-01T00:00:00Z'
+    assert gl_release.remote_fields == {'commit.created_at'}
+
+
+class SlowRelease(GitLabRelease):
+    """Release whose remote inputs are only fetched once all are requested."""
+
+    prefetch_fields = ('tag', 'extra_metadata', 'contributors')
+
+    def __init__(self, release, fail=()):
+        """Init release."""
+        super(SlowRelease, self).__init__(release)
+        self.fail = fail
+        self.archive = mock.MagicMock()
+        # The tag, extra metadata, contributors and archive.
+        self.barrier = threading.Barrier(4)
+
+    def _fetch(self, name):
+        # Raises BrokenBarrierError unless all inputs are fetched at once.
+        self.barrier.wait(timeout=5)
+        if name in self.fail:
+            raise ValueError(name)
+        return name
+
+    tag = property(lambda self: self._fetch('tag'))
+    extra_metadata = property(lambda self: self._fetch('extra_metadata'))
+    contributors = property(lambda self: self._fetch('contributors'))
+
+    def open_archive(self):
+        """Return the mocked archive."""
+        self._fetch('archive')
+        return self.archive
+
+
+def test_release_prefetch(app, db, release):
+    """Test fetching the remote inputs of a release concurrently."""
+    gl_release = SlowRelease(release)
+    gl_release.gl = mock.MagicMock()
+    assert gl_release.prefetch() is gl_release.archive
+
+    gl_release = SlowRelease(release, fail=('tag', 'contributors'))
+    gl_release.gl = mock.MagicMock()
+    with pytest.raises(ReleasePrefetchError) as excinfo:
+        gl_release.prefetch()
+    assert set(excinfo.value.errors) == {'tag', 'contributors'}
+    # The opened archive is not leaked.
+    gl_release.archive.close.assert_called_once_with()
+
+
+@pytest.fixture()
+def location(db, tmpdir):
+    """Default files location."""
+    loc = Location(name='default', uri=str(tmpdir), default=True)
+    db.session.add(loc)
+    db.session.commit()
+    return loc
+
+
+class FakeDeposit(dict):
+    """Deposit with a files bucket, but without records."""
+
+    deposits = {}
+
+    def __init__(self, data):
+        """Init deposit."""
+        super(FakeDeposit, self).__init__(data, _deposit={})
+        self.id = uuid.uuid4()
+        self.files = FakeFiles()
+
+    @classmethod
+    def create(cls, data):
+        """Create deposit."""
+        deposit = cls(data)
+        cls.deposits[str(deposit.id)] = deposit
+        return deposit
+
+    @classmethod
+    def get_record(cls, id_):
+        """Get deposit."""
+        return cls.deposits[id_]
+
+    def publish(self):
+        """Publish deposit."""
+
+    def fetch_published(self):
+        """Return published record."""
+        return None, mock.MagicMock(model=None)
+
+
+class FakeFileObject(namedtuple('FakeFileObject', ['obj', 'data'])):
+    """File of a deposit."""
+
+    def dumps(self):
+        """Serialize the file."""
+        return dict(key=self.obj.key, file_id=str(self.obj.file_id))
+
+
+class FakeFiles(object):
+    """Files of a deposit, like ``invenio_records_files.api.FilesIterator``."""
+
+    file_cls = FakeFileObject
+
+    def __init__(self):
+        """Init files."""
+        self.bucket = Bucket.create()
+        self.filesmap = {}
+
+    def __setitem__(self, key, stream):
+        """Store a file."""
+        obj = ObjectVersion.create(self.bucket, key, stream=stream)
+        self.filesmap[key] = self.file_cls(obj, {}).dumps()
+
+    def __getitem__(self, key):
+        """Return a file."""
+        obj = ObjectVersion.get(self.bucket, key)
+        return self.file_cls(obj, self.filesmap[key])
+
+    def flush(self):
+        """Write the files map to the record."""
+
+
+def fake_gitlab_request(method, url, **kwargs):
+    """Answer the GitLab API requests of a release."""
+    response = requests.Response()
+    response.url = url
+    response._content_consumed = True
+    if '/repository/commits/' in url:
+        response.status_code = 200
+        response._content = b'{"created_at": "2019-01-01T00:00:00Z"}'
+        response.headers['Content-Type'] = 'application/json'
+    elif '/repository/archive' in url:
+        response.status_code = 200
+        response._content = b'archive'
+    else:
+        response.status_code = 404
+        response._content = b'{"message": "404 Not Found"}'
+    return response
+
+
+class FakeGitLab(object):
+    """GitLab client whose requests are answered by fake_gitlab_request."""
+
+    def __init__(self, request):
+        """Init client."""
+        self.request = request
+        self.api = gitlab.Gitlab('https://gitlab.com', oauth_token='token',
+                                 session=GitLabSession())
+
+    @property
+    def archive_downloads(self):
+        """Return the number of archive downloads."""
+        return len([call for call in self.request.call_args_list
+                    if '/repository/archive' in call.args[1]])
+
+
+@pytest.fixture()
+def fake_gitlab(app, location):
+    """Fake GitLab instance publishing releases as FakeDeposit."""
+    app.config['GITLAB_DEPOSIT_CLASS'] = FakeDeposit
+    with mock.patch('requests.Session.request') as request:
+        request.side_effect = fake_gitlab_request
+        yield FakeGitLab(request)
+
+
+@mock.patch('requests.Session.request')
+def test_release_http_calls(mock_request, app, db, location, release):
+    """Test the GitLab requests needed to publish a release."""
+    mock_request.side_effect = fake_gitlab_request
+    app.config['GITLAB_DEPOSIT_CLASS'] = FakeDeposit
+    gl_release = GitLabRelease(release)
+    gl_release.gl = mock.MagicMock()
+    gl_release.gl.api = gitlab.Gitlab(
+        'https://gitlab.com', oauth_token='token',
+        session=GitLabSession(cache=MemoryCache(maxsize=10)))
+
+    gl_release.publish()
+    urls = sorted(call.args[1] for call in mock_request.call_args_list)
+    project_url = 'https://gitlab.com/api/v4/projects/{0}'.format(
+        gl_release.payload['project_id'])
+    # The commit, the metadata file and the archive, but never the project.
+    assert urls == [
+        project_url + '/repository/archive.zip',
+        project_url + '/repository/commits/' + gl_release.commit_sha,
+        project_url + '/repository/files/.invenio.json/raw',
+    ]
+
+
+def test_release_archive_deduplication(app, db, release, user, fake_gitlab):
+    """Test reusing the stored archive for tags of the same commit."""
+    def publish(release):
+        gl_release = GitLabRelease(release)
+        gl_release.gl = mock.MagicMock(api=fake_gitlab.api)
+        gl_release.publish()
+        downloads = fake_gitlab.archive_downloads
+        fake_gitlab.request.reset_mock()
+        return gl_release, downloads
+
+    first, downloads = publish(release)
+    assert downloads == 1
+    payload = dict(release.event.payload, ref='refs/tags/v1.0.1')
+    event = Event(receiver_id='gitlab', user_id=user.id, payload=payload)
+    db.session.add(event)
+    second, downloads = publish(Release.create(event))
+    assert downloads == 0
+
+    archive = ReleaseArchive.query.one()
+    assert archive.commit_sha == release.event.payload['checkout_sha']
+    assert archive.references == 2
+    objects = ObjectVersion.query.filter_by(file_id=archive.file_id).all()
+    assert sorted(obj.key for obj in objects) == [
+        'example-v1.0.0.zip', 'example-v1.0.1.zip']
+
+    # Entries are only pruned once no object uses the archive anymore.
+    objects[0].remove()
+    assert ReleaseArchive.prune() == 0
+    objects[1].remove()
+    assert ReleaseArchive.prune() == 1
+
+
+class FlakyDeposit(FakeDeposit):
+    """Deposit whose publishing fails ``failures`` times."""
+
+    failures = 0
+    attempts = 0
+
+    def publish(self):
+        """Fail to publish the deposit."""
+        FlakyDeposit.attempts += 1
+        if FlakyDeposit.failures:
+            FlakyDeposit.failures -= 1
+            raise requests.exceptions.ConnectionError('Indexing failed')
+
+
+def test_release_pipeline(app, db, release, fake_gitlab):
+    """Test retrying and resuming the stages of the publish pipeline."""
+    app.config.update(
+        GITLAB_DEPOSIT_CLASS=FlakyDeposit,
+        GITLAB_RELEASE_PIPELINE=True,
+        GITLAB_RELEASE_STAGE_MAX_RETRIES=1,
+    )
+    FlakyDeposit.failures = 3
+    # Let eagerly run tasks retry instead of raising.
+    celery = app.extensions['flask-celeryext'].celery
+    celery.conf.task_eager_propagates = False
+
+    gl = mock.MagicMock(api=fake_gitlab.api)
+    with mock.patch.object(GitLabRelease, 'gl', gl):
+        # Publishing is retried once, then the release fails.
+        with pytest.raises(requests.exceptions.ConnectionError):
+            process_release(release.tag, release.project_id)
+        assert FlakyDeposit.attempts == 2
+        assert release.status == ReleaseStatus.FAILED
+        assert release.stage == 'build_deposit'
+        assert release.errors['errors'] == 'Indexing failed'
+
+        # Processing the release again resumes with the publish stage.
+        process_release(release.tag, release.project_id)
+    assert FlakyDeposit.attempts == 4
+    # Published releases are not processed again.
+    process_release(release.tag, release.project_id)
+    assert FlakyDeposit.attempts == 4
+    assert fake_gitlab.archive_downloads == 1
+    assert release.status == ReleaseStatus.PUBLISHED
+    assert release.stage == 'finalise'
+    assert release.stage_data['metadata']['version'] == 'v1.0.0'
+
+    # Only the deposit keeps the archive once the staging bucket is removed.
+    archive = ReleaseArchive.query.one()
+    assert archive.references == 1
+    obj = ObjectVersion.query.filter_by(file_id=archive.file_id).one()
+    assert obj.key == 'example-v1.0.0.zip'
+    assert obj.mimetype == 'application/zip'
+
+
+class InvalidDeposit(FakeDeposit):
+    """Deposit rejecting its metadata until ``failures`` reaches zero."""
+
+    failures = 0
+
+    @classmethod
+    def create(cls, data):
+        """Create deposit."""
+        if cls.failures:
+            cls.failures -= 1
+            raise RESTException(description='Invalid metadata')
+        return super(InvalidDeposit, cls).create(data)
+
+
+def test_release_pipeline_cleanup(app, db, release, tmpdir, fake_gitlab):
+    """Test discarding the staged archive of a failed release."""
+    spool = tmpdir.mkdir('spool')
+    app.config.update(
+        GITLAB_DEPOSIT_CLASS=InvalidDeposit,
+        GITLAB_RELEASE_PIPELINE=True,
+        GITLAB_ARCHIVE_SPOOL=True,
+        GITLAB_ARCHIVE_SPOOL_DIR=str(spool),
+    )
+    InvalidDeposit.failures = 1
+    celery = app.extensions['flask-celeryext'].celery
+    celery.conf.task_eager_propagates = False
+
+    gl = mock.MagicMock(api=fake_gitlab.api)
+    with mock.patch.object(GitLabRelease, 'gl', gl):
+        with pytest.raises(RESTException):
+            process_release(release.tag, release.project_id)
+        assert release.status == ReleaseStatus.FAILED
+        # The staging bucket is removed and the archive is stored again by
+        # the next attempt, from the spool kept for it.
+        assert Bucket.query.count() == 0
+        assert spool.listdir() != []
+        assert release.stage == 'resolve'
+        assert 'file_id' not in release.stage_data
+
+        process_release(release.tag, release.project_id)
+    assert release.status == ReleaseStatus.PUBLISHED
+    assert fake_gitlab.archive_downloads == 1
+    # Only the deposit bucket is left.
+    assert Bucket.query.count() == 1
+    assert spool.listdir() == []
+
+
+def test_release_pipeline_queue(app, db, release):
+    """Test routing every stage of the pipeline by repository size."""
+    app.config.update(
+        GITLAB_RELEASE_PIPELINE=True,
+        GITLAB_RELEASE_QUEUES=[
+            dict(queue='gitlab-small', max_size=1000, time_limit=60),
+            dict(queue='gitlab-large', time_limit=3600),
+        ],
+    )
+    with mock.patch.object(GitLabRelease, 'gl', mock.MagicMock()), \
+            mock.patch('invenio_gitlab.utils.get_repository_size',
+                       return_value=5000), \
+            mock.patch('invenio_gitlab.tasks.chain') as chain:
+        process_release(release.tag, release.project_id)
+    signatures = list(chain.call_args.args[0])
+    assert [sig.args[1] for sig in signatures] == list(GitLabRelease.stages)
+    for sig in signatures:
+        assert sig.options['queue'] == 'gitlab-large'
+        assert sig.options['time_limit'] == 3600
+    chain.return_value.apply_async.assert_called_once_with()
+
+
+def test_release_batch(app, db, release, user, fake_gitlab):
+    """Test processing received releases in batches."""
+    app.config.update(
+        GITLAB_RELEASE_BATCH_SIZE=2,
+        GITLAB_RELEASE_BATCH_WORKERS=1,
+        GITLAB_RELEASE_DRAIN_THRESHOLD=1,
+        GITLAB_RELEASE_DRAIN_MAX_BATCHES=1,
+    )
+    for tag in ('v1.0.1', 'v1.0.2'):
+        payload = dict(release.event.payload, ref='refs/tags/' + tag)
+        event = Event(receiver_id='gitlab', user_id=user.id, payload=payload)
+        db.session.add(event)
+        Release.create(event)
+    db.session.commit()
+
+    def statuses():
+        return sorted(str(r.status) for r in Release.query)
+
+    with mock.patch.object(GitLabAPI, 'access_token', 'token'), \
+            mock.patch.object(GitLabAPI, 'api', fake_gitlab.api):
+        # The oldest releases are claimed first.
+        drain_releases()
+        assert statuses() == ['D', 'D', 'R']
+        assert release.status == ReleaseStatus.PUBLISHED
+        # Too few releases are left for another batch.
+        drain_releases()
+        assert statuses() == ['D', 'D', 'R']
+        app.config['GITLAB_RELEASE_DRAIN_THRESHOLD'] = 0
+        drain_releases()
+    assert statuses() == ['D', 'D', 'D']
+
+
+def test_release_concurrency(app, db, release, fake_gitlab):
+    """Test deferring releases over the concurrency limit of a project."""
+    app.config['GITLAB_RELEASE_PROJECT_CONCURRENCY'] = 1
+    scope = 'project:{0}'.format(release.project_id)
+    ReleaseLease.acquire(scope, 1, 'other', timedelta(minutes=5))
+    db.session.commit()
+
+    gl = mock.MagicMock(api=fake_gitlab.api)
+    with mock.patch.object(GitLabRelease, 'gl', gl):
+        with pytest.raises(Retry):
+            process_release(release.tag, release.project_id)
+        assert release.status == ReleaseStatus.RECEIVED
+
+        ReleaseLease.release('other')
+        process_release(release.tag, release.project_id)
+    assert release.status == ReleaseStatus.PUBLISHED
+    assert ReleaseLease.query.count() == 0
+
+
+def test_release_pipeline_leases(app, db, release, fake_gitlab):
+    """Test freeing the slots of releases the pipeline does not publish."""
+    app.config.update(
+        GITLAB_RELEASE_PIPELINE=True,
+        GITLAB_RELEASE_PROJECT_CONCURRENCY=1,
+    )
+    gl = mock.MagicMock(api=fake_gitlab.api)
+    with mock.patch.object(GitLabRelease, 'gl', gl), \
+            mock.patch.object(GitLabRelease, 'verify_sender',
+                              return_value=False):
+        with pytest.raises(InvalidSenderError):
+            process_release(release.tag, release.project_id,
+                            verify_sender=True)
+    assert ReleaseLease.query.count() == 0
+
+    # Stages of a release taken over by another task are skipped.
+    scope = 'project:{0}'.format(release.project_id)
+    ReleaseLease.acquire(scope, 1, 'stale:{0}'.format(release.id),
+                         timedelta(minutes=5))
+    release.claim_token = 'other'
+    db.session.commit()
+    run_release_stage(str(release.id), 'resolve', 'stale')
+    assert release.stage is None
+    assert ReleaseLease.query.count() == 0
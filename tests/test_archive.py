@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Test streaming of repository archives."""
+
+import hashlib
+import os
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+
+import pytest
+from helpers import mock
+from invenio_files_rest.storage import PyFSFileStorage
+from requests.exceptions import ChunkedEncodingError
+
+from invenio_gitlab.archive import ArchiveStream, SpooledArchive
+
+CHUNK_SIZE = 64 * 1024
+
+
+def archive_chunks(size):
+    """Yield a fake archive of the given size, like a GitLab response."""
+    for offset in range(0, size, CHUNK_SIZE):
+        yield bytes(bytearray([offset // CHUNK_SIZE % 256])) * min(
+            CHUNK_SIZE, size - offset)
+
+
+def test_archive_stream():
+    """Test reading, checksum and size of an archive stream."""
+    data = b''.join(archive_chunks(3 * CHUNK_SIZE + 10))
+    stream = ArchiveStream(archive_chunks(len(data)))
+    assert stream.read(10) == data[:10]
+    assert stream.read(2 * CHUNK_SIZE) == data[10:2 * CHUNK_SIZE + 10]
+    assert stream.read() == data[2 * CHUNK_SIZE + 10:]
+    assert stream.read(10) == b''
+    assert stream.size == len(data)
+    assert stream.checksum == 'md5:' + hashlib.md5(data).hexdigest()
+
+
+def store_archive(tmpdir, size):
+    """Store an archive of the given size and return the peak memory."""
+    stream = ArchiveStream(archive_chunks(size))
+    storage = PyFSFileStorage(str(tmpdir.join('archive-{0}'.format(size))))
+    tracemalloc.start()
+    try:
+        _, written, checksum = storage.save(stream, chunk_size=CHUNK_SIZE * 4)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert written == stream.size == size
+    assert checksum == stream.checksum
+    return peak
+
+
+def test_archive_stream_memory(tmpdir):
+    """Test that memory usage does not grow with the archive size."""
+    # Warm up, so one-off allocations of the storage are not measured.
+    store_archive(tmpdir, CHUNK_SIZE)
+    small = store_archive(tmpdir, 4 * 1024 * 1024)
+    large = store_archive(tmpdir, 64 * 1024 * 1024)
+    # A few copies of one storage chunk, independent of the archive size.
+    assert large < 16 * CHUNK_SIZE
+    assert abs(large - small) < CHUNK_SIZE
+
+
+class FlakyGitLab(object):
+    """GitLab whose archive downloads break after ``fail_after`` bytes."""
+
+    def __init__(self, data, fail_after=None, ranges=True, delay=0):
+        """Init fake GitLab."""
+        self.data = data
+        self.fail_after = list(fail_after or [])
+        self.ranges = ranges
+        self.delay = delay
+        self.requests = []
+
+    def http_get(self, path, extra_headers=None, **kwargs):
+        """Return a streamed archive response."""
+        self.requests.append(dict(extra_headers))
+        offset = 0
+        response = mock.MagicMock(headers={'ETag': '"v1"'}, status_code=200)
+        if 'Range' in extra_headers and self.ranges:
+            offset = int(extra_headers['Range'][6:-1])
+            response.status_code = 206
+        fail_after = self.fail_after.pop(0) if self.fail_after else None
+
+        def iter_content(chunk_size):
+            for start in range(offset, len(self.data), chunk_size):
+                if fail_after is not None and start >= fail_after:
+                    raise ChunkedEncodingError('Connection broken')
+                time.sleep(self.delay)
+                yield self.data[start:start + chunk_size]
+
+        response.iter_content = iter_content
+        return response
+
+
+def spooled_archive(tmpdir, gl, sha='a' * 40, **kwargs):
+    """Create a spooled archive of a fake project."""
+    project = mock.MagicMock(id=1, encoded_id=1)
+    project.manager.gitlab = gl
+    return SpooledArchive(project, sha, 'zip', directory=str(tmpdir),
+                          chunk_size=10, sleep=lambda seconds: None, **kwargs)
+
+
+def test_spooled_archive_resume(app, tmpdir):
+    """Test resuming an interrupted archive download."""
+    data = bytes(bytearray(range(100)))
+    gl = FlakyGitLab(data, fail_after=[30, 70])
+    archive = spooled_archive(tmpdir, gl)
+    archive.download()
+    assert [r.get('Range') for r in gl.requests] == \
+        [None, 'bytes=30-', 'bytes=70-']
+    assert gl.requests[1]['If-Range'] == '"v1"'
+    assert archive.size == 100
+    assert archive.checksum == 'md5:' + hashlib.md5(data).hexdigest()
+    assert archive.open().read() == data
+
+    # A completed download is reused.
+    archive = spooled_archive(tmpdir, gl)
+    archive.download()
+    assert len(gl.requests) == 3 and archive.size == 100
+
+    archive.remove()
+    assert tmpdir.listdir() == []
+
+
+def test_spooled_archive_restart(app, tmpdir):
+    """Test restarting downloads if the server ignores ranges."""
+    data = bytes(bytearray(range(100)))
+    archive = spooled_archive(
+        tmpdir, FlakyGitLab(data, fail_after=[50], ranges=False))
+    archive.download()
+    assert archive.open().read() == data
+
+    archive = spooled_archive(
+        tmpdir.mkdir('other'), FlakyGitLab(data, fail_after=[10, 10, 10]),
+        max_retries=2)
+    with pytest.raises(ChunkedEncodingError):
+        archive.download()
+
+
+def test_spooled_archive_concurrent(app, tmpdir):
+    """Test releases of the same commit sharing a spooled archive."""
+    data = bytes(bytearray(range(100)))
+    gl = FlakyGitLab(data, delay=0.01)
+    archives = [spooled_archive(tmpdir, gl) for _ in range(2)]
+    streams = [None, None]
+
+    def download(index):
+        with app.app_context():
+            streams[index] = archives[index].open()
+
+    threads = [threading.Thread(target=download, args=(index,))
+               for index in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The archive is downloaded once and read by both releases.
+    assert len(gl.requests) == 1
+    assert [archive.size for archive in archives] == [100, 100]
+
+    # Removing the spool does not break the stream of the other release.
+    assert streams[0].read() == data
+    streams[0].close()
+    archives[0].remove()
+    assert tmpdir.listdir() == []
+    assert streams[1].read() == data
+    streams[1].close()
+
+
+def test_spooled_archive_sweep(app, tmpdir):
+    """Test deleting stale spooled archives."""
+    data = bytes(bytearray(range(100)))
+    failed = spooled_archive(tmpdir, FlakyGitLab(data, fail_after=[50]),
+                             max_retries=0)
+    with pytest.raises(ChunkedEncodingError):
+        failed.download()
+    stale = time.time() - 3600
+    for path in tmpdir.listdir():
+        os.utime(str(path), (stale, stale))
+    recent = spooled_archive(tmpdir, FlakyGitLab(data), sha='b' * 40)
+    recent.download()
+
+    assert SpooledArchive.sweep(str(tmpdir), timedelta(minutes=30)) == 1
+    assert sorted(path.basename for path in tmpdir.listdir()) == sorted(
+        os.path.basename(path) for path in (
+            recent.path, recent.checkpoint, recent.lockfile))
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the pooled GitLab clients."""
+
+import requests
+from helpers import mock
+
+from invenio_gitlab.cache import LRUCache, MemoryCache
+from invenio_gitlab.client import GitLabClientPool, GitLabSession
+from invenio_gitlab.ratelimit import MemoryRateLimitBackend, RateLimiter
+
+
+class FakeTimer(object):
+    """Manually advanced clock."""
+
+    def __init__(self):
+        """Init timer."""
+        self.now = 0
+
+    def __call__(self):
+        """Return current time."""
+        return self.now
+
+
+def test_lru_cache():
+    """Test LRU eviction and expiry."""
+    timer = FakeTimer()
+    cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    # 'b' is now the least recently used entry.
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    timer.now = 10
+    assert cache.get('a') is None
+    assert cache.get('c', 'missing') == 'missing'
+
+
+def test_lru_cache_bytes():
+    """Test eviction by the total size of the values."""
+    cache = LRUCache(maxsize=10, maxbytes=10, getsizeof=len)
+    cache.set('a', b'aaaa')
+    cache.set('b', b'bbbb')
+    cache.set('c', b'cccc')
+    assert cache.get('a') is None
+    assert cache.currbytes == 8
+    # Replaced values are accounted once.
+    cache.set('c', b'cc')
+    assert cache.currbytes == 6
+    # Values larger than the cache are not stored.
+    cache.set('d', b'd' * 11)
+    assert cache.get('d') is None
+    assert cache.get('b') == b'bbbb'
+    cache.pop('b')
+    assert cache.currbytes == 2
+
+
+@mock.patch('gitlab.Gitlab')
+def test_client_pool(mock_gl):
+    """Test that clients and sessions are reused."""
+    mock_gl.side_effect = lambda *args, **kwargs: mock.MagicMock()
+    pool = GitLabClientPool(maxsize=2)
+
+    client = pool.get('https://gitlab.com', 'token1')
+    assert pool.get('https://gitlab.com', 'token1') is client
+    assert mock_gl.call_count == 1
+    client.auth.assert_called_once_with()
+
+    other = pool.get('https://gitlab.com', 'token2')
+    assert other is not client
+    # Both clients share the keep-alive session of the instance.
+    sessions = [c.kwargs['session'] for c in mock_gl.call_args_list]
+    assert sessions[0] is sessions[1]
+    assert pool.get('https://gitlab.example.org', 'token1') is not client
+    assert pool.session('https://gitlab.example.org') is not sessions[0]
+
+    pool.discard('https://gitlab.com', 'token2')
+    assert pool.get('https://gitlab.com', 'token2') is not other
+
+    pool.clear()
+    assert pool.get('https://gitlab.com', 'token1') is not client
+
+
+@mock.patch('gitlab.Gitlab')
+def test_client_pool_lazy_auth(mock_gl):
+    """Test that the current user is only resolved on demand."""
+    client = mock.MagicMock(user=None)
+
+    def auth():
+        client.user = mock.MagicMock(attributes={'id': 1234})
+
+    client.auth.side_effect = auth
+    mock_gl.return_value = client
+    pool = GitLabClientPool(lazy_auth=True)
+
+    assert pool.get('https://gitlab.com', 'token') is client
+    assert not client.auth.called
+
+    user = pool.user('https://gitlab.com', 'token')
+    assert user.attributes['id'] == 1234
+    # The resolved user is cached per token.
+    assert pool.user('https://gitlab.com', 'token') is user
+    client.auth.assert_called_once_with()
+
+
+def make_response(status, content=b'', headers=None):
+    """Create a response as returned by the transport."""
+    response = requests.Response()
+    response.status_code = status
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+
+@mock.patch('requests.Session.request')
+def test_session_revalidation(mock_request):
+    """Test that cached responses are revalidated with their ETag."""
+    session = GitLabSession(cache=MemoryCache(maxsize=10))
+    url = 'https://gitlab.com/api/v4/projects/1'
+    headers = {'Authorization': 'Bearer token1'}
+
+    mock_request.return_value = make_response(
+        200, b'{"id": 1}', {'ETag': 'W/"abc"'})
+    assert session.get(url, headers=headers).json() == {'id': 1}
+
+    mock_request.return_value = make_response(304)
+    response = session.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {'id': 1}
+    sent = mock_request.call_args.kwargs['headers']
+    assert sent['If-None-Match'] == 'W/"abc"'
+
+    # Responses are never shared between users.
+    mock_request.return_value = make_response(200, b'{}')
+    session.get(url, headers={'Authorization': 'Bearer token2'})
+    assert 'If-None-Match' not in mock_request.call_args.kwargs['headers']
+
+    # Other methods bypass the cache.
+    session.post(url, headers=headers)
+    assert 'If-None-Match' not in mock_request.call_args.kwargs['headers']
+
+
+@mock.patch('requests.Session.request')
+def test_session_immutable(mock_request):
+    """Test that requests pinned to a commit are answered from the cache."""
+    session = GitLabSession(cache=MemoryCache(maxsize=10), max_item_size=10)
+    sha = 'a' * 40
+    url = 'https://gitlab.com/api/v4/projects/1/repository/files/x/raw'
+
+    mock_request.return_value = make_response(200, b'content')
+    assert session.get(url, params={'ref': sha}).content == b'content'
+    assert session.get(url, params={'ref': sha}).content == b'content'
+    assert mock_request.call_count == 1
+
+    # Branch names are mutable and always go to GitLab.
+    session.get(url, params={'ref': 'master'})
+    session.get(url, params={'ref': 'master'})
+    assert mock_request.call_count == 3
+
+    # Large responses are not cached.
+    mock_request.return_value = make_response(200, b'x' * 11)
+    session.get(url, params={'ref': 'b' * 40})
+    session.get(url, params={'ref': 'b' * 40})
+    assert mock_request.call_count == 5
+
+
+@mock.patch('requests.Session.request')
+def test_session_commit_statuses(mock_request):
+    """Test that mutable resources of a commit are revalidated."""
+    session = GitLabSession(cache=MemoryCache(maxsize=10))
+    commit_url = 'https://gitlab.com/api/v4/projects/1/repository/commits/' \
+        + 'a' * 40
+    mock_request.return_value = make_response(
+        200, b'[]', headers={'ETag': '"v1"'})
+    session.get(commit_url + '/statuses')
+    mock_request.return_value = make_response(304)
+    assert session.get(commit_url + '/statuses').content == b'[]'
+    assert mock_request.call_count == 2
+    assert mock_request.call_args.kwargs['headers'] == {
+        'If-None-Match': '"v1"'}
+
+    # The commit itself never changes.
+    mock_request.return_value = make_response(200, b'{}')
+    session.get(commit_url)
+    session.get(commit_url)
+    assert mock_request.call_count == 3
+
+
+@mock.patch('requests.Session.request')
+def test_session_pagination(mock_request):
+    """Test that pages of lists are not cached."""
+    session = GitLabSession(cache=MemoryCache(maxsize=10))
+    url = 'https://gitlab.com/api/v4/projects'
+    mock_request.return_value = make_response(
+        200, b'[]', headers={'ETag': '"v1"', 'X-Per-Page': '20'})
+    params = {'last_activity_after': '2019-01-01T00:00:00Z'}
+    session.get(url, params=params)
+    session.get(url, params=params)
+    session.get(url + '?page=2', headers={})
+    assert mock_request.call_count == 3
+    for call in mock_request.call_args_list:
+        assert 'If-None-Match' not in call.kwargs['headers']
+
+
+def test_rate_limiter():
+    """Test throttling with the shared token bucket."""
+    timer = FakeTimer()
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        timer.now += seconds
+
+    limiter = RateLimiter(
+        MemoryRateLimitBackend(), rate=2, burst=2, timer=timer, sleep=sleep)
+    limiter.acquire('token')
+    limiter.acquire('token')
+    assert sleeps == []
+    # The bucket is empty and refills with two tokens per second.
+    limiter.acquire('token')
+    assert sleeps == [0.5]
+    # Other tokens have their own bucket.
+    limiter.acquire('other')
+    assert sleeps == [0.5]
+
+    # GitLab reports that the limit is exhausted until the reset.
+    limiter.update('token', make_response(200, headers={
+        'RateLimit-Remaining': '0', 'RateLimit-Reset': str(timer.now + 30)}))
+    limiter.acquire('token')
+    assert sleeps == [0.5, 30]
+
+    # A rejected request blocks the token for the requested time.
+    limiter.update('token', make_response(429, headers={'Retry-After': '5'}))
+    limiter.acquire('token')
+    assert sleeps == [0.5, 30, 5]
+
+    # Invalid headers are ignored, even outside of an application context.
+    limiter.update('token', make_response(200, headers={
+        'RateLimit-Remaining': 'many'}))
+
+
+def test_rate_limit_backend_size():
+    """Test that the least recently used buckets are dropped."""
+    backend = MemoryRateLimitBackend(maxsize=2)
+    for key in ('a', 'b', 'c'):
+        assert backend.acquire(key, rate=1, burst=1, now=0) == 0
+    assert len(backend._buckets) == 2
+    # The bucket of 'a' was dropped and is full again.
+    assert backend.acquire('a', rate=1, burst=1, now=0) == 0
+    assert backend.acquire('c', rate=1, burst=1, now=0) == 1
+
+
+@mock.patch('requests.Session.request')
+def test_session_rate_limit(mock_request):
+    """Test that only requests reaching GitLab are throttled."""
+    limiter = mock.MagicMock()
+    session = GitLabSession(
+        cache=MemoryCache(maxsize=10), rate_limiter=limiter)
+    url = 'https://gitlab.com/api/v4/projects/1/repository/commits/' + 'a' * 40
+    mock_request.return_value = make_response(200, b'{}')
+
+    session.get(url, headers={'Authorization': 'Bearer token'})
+    session.get(url, headers={'Authorization': 'Bearer token'})
+    assert limiter.acquire.call_count == 1
+    key = limiter.acquire.call_args.args[0]
+    limiter.update.assert_called_once_with(key, mock_request.return_value)
+
+    session.get(url, headers={'Authorization': 'Bearer other'})
+    assert limiter.acquire.call_args.args[0] != key
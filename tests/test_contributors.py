@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 HZDR
+#
+# This file is part of RODARE.
+#
+# invenio-gitlab is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# invenio-gitlab is distributed in the hope that
+# it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rodare. If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the contributor resolver."""
+
+from helpers import mock
+
+from invenio_gitlab.cache import MemoryCache
+from invenio_gitlab.contributors import ContributorResolver
+
+
+def contributor(name, commits):
+    """Create a contributor as returned by GitLab."""
+    return dict(name=name, email=name.lower() + '@hzdr.de', commits=commits)
+
+
+def commit(name):
+    """Create a commit as returned by the compare API."""
+    return dict(author_name=name, author_email=name.lower() + '@hzdr.de')
+
+
+def test_contributor_resolver():
+    """Test full, cached and incremental resolution of contributors."""
+    project = mock.MagicMock(id=1234)
+    project.repository_contributors.return_value = iter([
+        contributor('Alice', 10), contributor('Bob', 5),
+        contributor('Carol', 1),
+    ])
+    resolver = ContributorResolver(
+        project, MemoryCache(maxsize=10), max_contributors=2)
+
+    assert resolver.resolve('a' * 40) == [
+        contributor('Alice', 10), contributor('Bob', 5)]
+    project.repository_contributors.assert_called_once_with(
+        order_by='commits', sort='desc', iterator=True, per_page=2,
+        ref='a' * 40)
+    # Contributors of a commit are cached.
+    assert resolver.resolve('a' * 40)[0]['name'] == 'Alice'
+    assert project.repository_contributors.call_count == 1
+
+    # The next release only fetches the commits since the previous one.
+    project.repository_compare.return_value = dict(commits=[
+        commit('Dave'), commit('Bob'), commit('Dave'), commit('Bob'),
+        commit('Bob')])
+    assert resolver.resolve('b' * 40, previous_sha='a' * 40) == [
+        contributor('Alice', 10), contributor('Bob', 8)]
+    project.repository_compare.assert_called_once_with('a' * 40, 'b' * 40)
+    assert project.repository_contributors.call_count == 1
+
+    # Without cached contributors of the previous release, all are fetched.
+    project.repository_contributors.return_value = iter([
+        contributor('Alice', 11)])
+    assert resolver.resolve('c' * 40, previous_sha='d' * 40) == [
+        contributor('Alice', 11)]
+
+
+def test_contributor_resolver_without_ref():
+    """Test GitLab counting the contributors of the default branch."""
+    project = mock.MagicMock(id=1234)
+    # The default branch is ahead of the released tag.
+    full_project = project.manager.get.return_value
+    full_project.branches.get.return_value.commit = dict(id='f' * 40)
+    project.repository_contributors.side_effect = lambda **kwargs: iter([
+        contributor('Alice', 10), contributor('Bob', 5)])
+    resolver = ContributorResolver(
+        project, MemoryCache(maxsize=10), max_contributors=2, ref=False)
+
+    assert resolver.resolve('a' * 40)[0] == contributor('Alice', 10)
+    assert 'ref' not in project.repository_contributors.call_args.kwargs
+    full_project.branches.get.assert_called_once_with(
+        full_project.default_branch)
+    # The counts are cached, but not used for the next release.
+    assert resolver.resolve('a' * 40)[0] == contributor('Alice', 10)
+    assert project.repository_contributors.call_count == 1
+    resolver.resolve('b' * 40, previous_sha='a' * 40)
+    assert not project.repository_compare.called
+    assert project.repository_contributors.call_count == 2
+
+    # Counts of the default branch head are exact.
+    resolver.resolve('f' * 40)
+    project.repository_compare.return_value = dict(commits=[commit('Bob')])
+    assert resolver.resolve('g' * 40, previous_sha='f' * 40)[1] == \
+        contributor('Bob', 6)
+    project.repository_compare.assert_called_once_with('f' * 40, 'g' * 40)
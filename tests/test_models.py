@@ -21,13 +21,16 @@
 
 import fnmatch
 import uuid
+from datetime import datetime, timedelta
 
 import pytest
+from invenio_oauthclient.models import RemoteAccount
 from invenio_webhooks.models import Event
 
 from invenio_gitlab.errors import NoVersionTagError, ProjectAccessError, \
     ProjectDisabledError, ReleaseAlreadyReceivedError
-from invenio_gitlab.models import Project, Release
+from invenio_gitlab.models import AccountProject, Project, Release, \
+    ReleaseLease, ReleaseStatus
 
 
 def test_project(app, db, tester_id):
@@ -130,3 +133,130 @@ def test_release(app, db, project, user, event, hook_response):
 
     with pytest.raises(NoVersionTagError):
         release = Release.create(event)
+
+
+def test_release_claim(app, db, release):
+    """Test claiming a release for processing."""
+    claimed = Release.claim(release.tag, release.project_id, 'task-1')
+    db.session.commit()
+    assert claimed.id == release.id
+    assert claimed.status == ReleaseStatus.PROCESSING
+    assert claimed.claim_token == 'task-1'
+
+    # Other tasks cannot claim it, but a redelivered task can.
+    assert Release.claim(release.tag, release.project_id, 'task-2') is None
+    assert Release.claim(release.tag, release.project_id, 'task-1') is not None
+
+    # Failed releases can be claimed again, published releases cannot.
+    release.status = ReleaseStatus.FAILED
+    db.session.commit()
+    assert Release.claim(
+        release.tag, release.project_id, 'task-2').claim_token == 'task-2'
+    release.status = ReleaseStatus.PUBLISHED
+    db.session.commit()
+    assert Release.claim(release.tag, release.project_id, 'task-2') is None
+
+
+def test_release_claim_received(app, db, release):
+    """Test claiming received releases in a batch."""
+    assert [r.id for r in Release.claim_received('batch-1', 10)] == \
+        [release.id]
+    db.session.commit()
+    assert Release.claim_received('batch-2', 10) == []
+    # A redelivered batch resumes its own releases.
+    assert [r.id for r in Release.claim_received('batch-1', 10)] == \
+        [release.id]
+    db.session.commit()
+    assert Release.query.filter(Release.claimable()).count() == 0
+
+    # Claims older than GITLAB_RELEASE_CLAIM_TTL are taken over.
+    Release.query.filter_by(id=release.id).update(
+        {Release.updated: datetime.utcnow() - timedelta(days=1)},
+        synchronize_session=False)
+    db.session.commit()
+    assert Release.query.filter(Release.claimable()).count() == 1
+    claimed = Release.claim_received('batch-2', 10)
+    db.session.commit()
+    assert claimed[0].claim_token == 'batch-2'
+    assert Release.claim_received('batch-3', 10) == []
+
+
+def test_release_lease(app, db):
+    """Test leasing concurrency slots."""
+    ttl = timedelta(minutes=5)
+    assert ReleaseLease.acquire('project:1', 2, 'a', ttl)
+    assert ReleaseLease.acquire('project:1', 2, 'b', ttl)
+    assert not ReleaseLease.acquire('project:1', 2, 'c', ttl)
+    # Tasks renew their own slot.
+    assert ReleaseLease.acquire('project:1', 2, 'a', ttl)
+    assert ReleaseLease.query.count() == 2
+
+    # Slots of all scopes are taken, or none.
+    assert not ReleaseLease.acquire_all(
+        {'user:1': 1, 'project:1': 2}, 'c', ttl)
+    assert ReleaseLease.query.filter_by(token='c').count() == 0
+
+    # Freed and expired slots are taken over.
+    ReleaseLease.release('a')
+    ReleaseLease.query.filter_by(token='b').one().expires_at = \
+        datetime.utcnow() - ttl
+    assert ReleaseLease.acquire_all({'user:1': 1, 'project:1': 2}, 'c', ttl)
+    assert ReleaseLease.acquire('project:1', 2, 'd', ttl)
+    assert sorted(lease.token for lease in ReleaseLease.query) == \
+        ['c', 'c', 'd']
+
+
+def test_project_rename(app, db, tester_id):
+    """Test bulk renaming of projects."""
+    Project.create(tester_id, gitlab_id=1, name='tester/one')
+    Project.create(tester_id, gitlab_id=2, name='tester/two')
+    Project.create(None, gitlab_id=3, name='other/three')
+    db.session.commit()
+
+    renamed = Project.rename(tester_id, {
+        1: 'tester/one',
+        2: 'tester/renamed',
+        3: 'tester/three',
+    })
+    db.session.commit()
+    # Only changed projects of the user are updated.
+    assert renamed == 1
+    assert Project.query.filter_by(gitlab_id=1).one().name == 'tester/one'
+    assert Project.query.filter_by(gitlab_id=2).one().name == 'tester/renamed'
+    assert Project.query.filter_by(gitlab_id=3).one().name == 'other/three'
+    assert Project.rename(tester_id, {}) == 0
+
+
+def test_account_project(app, db, tester_id):
+    """Test the cached account projects."""
+    account = RemoteAccount.create(tester_id, 'gitlab_key_changeme', {})
+    db.session.commit()
+
+    AccountProject.update_projects(account.id, {
+        1: dict(full_name='tester/one', description=None),
+        2: dict(full_name='tester/two', description='Two'),
+    })
+    db.session.commit()
+    two = AccountProject.query.filter_by(gitlab_id=2).one()
+    synced_at = two.synced_at
+
+    # Unchanged projects are not written.
+    AccountProject.update_projects(account.id, {
+        1: dict(full_name='tester/renamed', description=None),
+        2: dict(full_name='tester/two', description='Two'),
+    })
+    db.session.commit()
+    assert AccountProject.query.filter_by(gitlab_id=1).one().full_name == \
+        'tester/renamed'
+    assert AccountProject.query.filter_by(gitlab_id=2).one().synced_at == \
+        synced_at
+
+    # Projects not seen by a sync are removed.
+    start = datetime.utcnow()
+    AccountProject.update_projects(account.id, {
+        2: dict(full_name='tester/two', description='Two'),
+    }, seen_at=start)
+    db.session.commit()
+    assert AccountProject.prune(account.id, start) == 1
+    db.session.commit()
+    assert [p.gitlab_id for p in AccountProject.query] == [2]
@@ -20,13 +20,18 @@
 """Test for GitLab oauth remote app."""
 
 import pytest
+from celery.exceptions import Retry
 from flask import session, url_for
 from flask_login import current_user
+from gitlab import GitlabDeleteError
 from helpers import GitlabMock, _get_state, mock, mock_response
 from invenio_accounts.models import User
 from invenio_oauthclient.models import RemoteAccount, RemoteToken, UserIdentity
 from six.moves.urllib_parse import parse_qs, urlparse
 
+from invenio_gitlab.client import GitLabClientPool
+from invenio_gitlab.tasks import disconnect_gitlab
+
 
 def test_login(client):
     """Test login via GitLab."""
@@ -184,3 +189,31 @@ def test_not_authenticated(app, client, db):
         url_for('invenio_oauthclient.disconnect', remote_app='gitlab')
     )
     assert resp.status_code == 302
+
+
+@mock.patch.object(GitLabClientPool, 'get')
+def test_disconnect_hooks(mock_get, app):
+    """Test removing the webhooks of a disconnected account."""
+    projects = {}
+
+    def get_project(project_id, lazy=False):
+        return projects.setdefault(project_id, mock.MagicMock())
+
+    mock_get.return_value.projects.get.side_effect = get_project
+    get_project(2).hooks.delete.side_effect = GitlabDeleteError(
+        '404 Not found', 404)
+    get_project(3).hooks.delete.side_effect = GitlabDeleteError(
+        '500 Internal Server Error', 500)
+
+    with mock.patch.object(disconnect_gitlab, 'retry',
+                           return_value=Retry()) as retry:
+        with pytest.raises(Retry):
+            disconnect_gitlab('token', [[1, 10], [2, 20], [3, 30], [4, 40]])
+    for project_id, hook_id in [(1, 10), (2, 20), (3, 30), (4, 40)]:
+        projects[project_id].hooks.delete.assert_called_once_with(hook_id)
+    # Missing hooks count as deleted, only failed ones are retried.
+    assert retry.call_args.kwargs['args'] == ('token', [[3, 30]])
+
+    get_project(3).hooks.delete.side_effect = None
+    disconnect_gitlab('token', [[3, 30]])
+    assert projects[3].hooks.delete.call_count == 2
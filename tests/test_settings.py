@@ -25,7 +25,7 @@ from flask import url_for
 from helpers import GitlabMock, _get_state, login_user, mock, mock_response
 
 from invenio_gitlab.api import GitLabAPI
-from invenio_gitlab.models import Project
+from invenio_gitlab.models import AccountProject, Project
 
 
 @mock.patch('gitlab.Gitlab')
@@ -66,8 +66,8 @@ def test_settings_index(mock_gl, app, client, db, user, example_gitlab):
     assert 'test/test' in resp_text
     assert 'https://gitlab.com/test/test' in resp_text
     gitlab = GitLabAPI(user_id=user.id)
-    projects = gitlab.account.extra_data['projects']
-    assert '1234' in projects
+    assert AccountProject.query.filter_by(
+        account_id=gitlab.account.id, gitlab_id=1234).count() == 1
 
     # Test webhook creation
     headers = {'Content-Type': 'application/json'}
@@ -140,3 +140,25 @@ def test_pattern_configuration(app, client, db, user, project):
     project_instance = Project.get(user_id=user.id,
                                    gitlab_id=1234)
     assert project_instance.release_pattern == 'v*'
+
+
+def test_archive_format_configuration(app, client, db, user, project):
+    """Test changing of the archive format of a project."""
+    url = url_for('invenio_gitlab_api.archive_format')
+    headers = {'Content-Type': 'application/json'}
+    login_user(client, user)
+
+    # Test with unsupported format.
+    data = {'id': 1234, 'format': 'rar'}
+    resp = client.post(url, data=json.dumps(data), headers=headers)
+    assert resp.status_code == 400
+
+    data['format'] = 'tar'
+    resp = client.post(url, data=json.dumps(data), headers=headers)
+    assert resp.status_code == 204
+    assert Project.get(user_id=user.id, gitlab_id=1234).archive_format == 'tar'
+
+    # Reset format to the configured default.
+    resp = client.delete(url, data=json.dumps(data), headers=headers)
+    assert resp.status_code == 204
+    assert Project.get(user_id=user.id, gitlab_id=1234).archive_format is None
@@ -21,9 +21,12 @@
 
 import json
 
+from helpers import mock
 from invenio_webhooks.models import Event
 
+from invenio_gitlab.api import GitLabAPI
 from invenio_gitlab.models import Project, Release
+from invenio_gitlab.receivers import GitLabReceiver
 
 
 def test_webhook_post(app, db, tester_id, hook_response):
@@ -53,3 +56,35 @@ def test_webhook_post(app, db, tester_id, hook_response):
         assert event.response_code == 409
 
     assert Release.query.count() == 1
+
+
+def test_release_queue(app, db, release):
+    """Test routing releases to queues by repository size."""
+    receiver = GitLabReceiver('gitlab')
+    assert receiver.release_queue(release) == {}
+
+    app.config['GITLAB_RELEASE_QUEUES'] = [
+        dict(queue='gitlab-small', max_size=1000, time_limit=60),
+        dict(queue='gitlab-large', time_limit=3600),
+    ]
+    api = mock.MagicMock()
+    api.projects.get.return_value.statistics = dict(repository_size=500)
+    with mock.patch.object(GitLabAPI, 'api', api):
+        assert receiver.release_queue(release) == dict(
+            queue='gitlab-small', time_limit=60)
+        # The size is cached per project.
+        api.projects.get.return_value.statistics = dict(repository_size=5000)
+        assert receiver.release_queue(release) == dict(
+            queue='gitlab-small', time_limit=60)
+        assert api.projects.get.call_count == 1
+        api.projects.get.assert_called_with(
+            release.project.gitlab_id, statistics=True)
+
+        # Large repositories and unknown sizes use the last queue.
+        release.project.gitlab_id = 4321
+        assert receiver.release_queue(release) == dict(
+            queue='gitlab-large', time_limit=3600)
+        api.projects.get.side_effect = Exception('Forbidden')
+        release.project.gitlab_id = 4322
+        assert receiver.release_queue(release) == dict(
+            queue='gitlab-large', time_limit=3600)